@@ -0,0 +1,163 @@
+import math
+import time
+import threading
+from array import array
+
+from line_protocol import DEFAULT_TAGS, MEASUREMENT_TAGS
+from modules import get_module_settings
+
+DEFAULT_WINDOW_SECONDS = 30
+DEFAULT_SAMPLE_INTERVAL = 1
+
+
+class RingBuffer:
+    """Fixed-size buffer of floats, the oldest value is overwritten once it is full."""
+    __slots__ = ("values", "size", "count", "position")
+
+    def __init__(self, size):
+        self.values = array('d', bytes(8 * size))
+        self.size = size
+        self.count = 0
+        self.position = 0
+
+    def append(self, value):
+        self.values[self.position] = value
+        self.position = (self.position + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def clear(self):
+        self.count = 0
+        self.position = 0
+
+    def summary(self):
+        ordered = sorted(self.values[:self.count] if self.count < self.size else self.values)
+        count = len(ordered)
+        return {
+            "min": ordered[0],
+            "max": ordered[-1],
+            "mean": sum(ordered) / count,
+            # nearest rank
+            "p95": ordered[max(0, math.ceil(0.95 * count) - 1)],
+            "p99": ordered[max(0, math.ceil(0.99 * count) - 1)],
+        }
+
+
+class SeriesWindow:
+    __slots__ = ("started_at", "buffers")
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.buffers = {}
+
+
+class WindowAggregator:
+    """
+    Samples selected fields at the collector's (high) rate and ships one summary per window.
+
+    `measurements` maps a measurement to {"window_seconds": ..., "fields": [...]}.
+    The listed fields of every record are appended to a ring buffer per series
+    and field, sized for one window at `sample_interval`. `add()` returns None
+    until the series' window is over, then the latest record with
+    <field>_min/_max/_mean/_p95/_p99 added for the aggregated fields. Records of
+    other measurements are decimated to one per series and `passthrough_seconds`
+    (by default the shortest window), the module samples them at the fast rate too.
+    """
+
+    def __init__(self, measurements, sample_interval, passthrough_seconds=None):
+        self.measurements = {
+            measurement: (float(spec.get("window_seconds", DEFAULT_WINDOW_SECONDS)), tuple(spec.get("fields", ())))
+            for measurement, spec in measurements.items()
+        }
+        self.sample_interval = sample_interval
+        if passthrough_seconds is None:
+            passthrough_seconds = min((window for window, _ in self.measurements.values()),
+                                      default=DEFAULT_WINDOW_SECONDS)
+        self.passthrough_seconds = float(passthrough_seconds)
+        self._windows = {}
+        self._passed = {}
+        self._lock = threading.Lock()
+        self._last_expiry = time.monotonic()
+
+    def add(self, measurement, record, now=None):
+        now = time.monotonic() if now is None else now
+        tag_keys = MEASUREMENT_TAGS.get(measurement, DEFAULT_TAGS)
+        series_key = (measurement,) + tuple(record.get(key) for key in tag_keys)
+        spec = self.measurements.get(measurement)
+        if spec is None:
+            return self._decimate(series_key, record, now)
+        window_seconds, fields = spec
+
+        with self._lock:
+            window = self._windows.get(series_key)
+            if window is None:
+                window = self._windows[series_key] = SeriesWindow(now)
+            for field in fields:
+                value = record.get(field)
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                buffer = window.buffers.get(field)
+                if buffer is None:
+                    # a little headroom for jitter of the sampling schedule
+                    size = max(1, math.ceil(window_seconds / self.sample_interval) + 2)
+                    buffer = window.buffers[field] = RingBuffer(size)
+                buffer.append(value)
+
+            # finish a window one sample early rather than one sample late
+            if now - window.started_at + self.sample_interval / 2 < window_seconds:
+                return None
+
+            record = dict(record)
+            for field, buffer in window.buffers.items():
+                if buffer.count:
+                    for name, value in buffer.summary().items():
+                        record[f"{field}_{name}"] = value
+                buffer.clear()
+            window.started_at = now
+            self._expire(now)
+        return record
+
+    def _decimate(self, series_key, record, now):
+        with self._lock:
+            passed_at = self._passed.get(series_key)
+            # same half-sample tolerance as the windows
+            if passed_at is not None and now - passed_at + self.sample_interval / 2 < self.passthrough_seconds:
+                return None
+            self._passed[series_key] = now
+            self._expire(now)
+        return record
+
+    def _expire(self, now):
+        # forget series that stopped reporting, at most once per window
+        if now - self._last_expiry < self.passthrough_seconds:
+            return
+        self._last_expiry = now
+        for series_key in [key for key, window in self._windows.items()
+                           if now - window.started_at > 3 * self.measurements[key[0]][0]]:
+            del self._windows[series_key]
+        for series_key in [key for key, passed_at in self._passed.items()
+                           if now - passed_at > 3 * self.passthrough_seconds]:
+            del self._passed[series_key]
+
+
+_aggregators = {}
+_aggregators_lock = threading.Lock()
+
+
+def get_sample_interval(module_name, default):
+    """Seconds between collections of `module_name`, its "aggregation" block samples faster than `default`."""
+    settings = get_module_settings(module_name).get("aggregation")
+    return float(settings.get("sample_interval", DEFAULT_SAMPLE_INTERVAL)) if settings else default
+
+
+def get_aggregator(module_name):
+    """Return the WindowAggregator configured for `module_name`, or None when it has no "aggregation" block."""
+    with _aggregators_lock:
+        if module_name not in _aggregators:
+            settings = get_module_settings(module_name).get("aggregation")
+            _aggregators[module_name] = WindowAggregator(
+                measurements=settings.get("measurements", {}),
+                sample_interval=float(settings.get("sample_interval", DEFAULT_SAMPLE_INTERVAL)),
+                passthrough_seconds=settings.get("passthrough_seconds"),
+            ) if settings else None
+        return _aggregators[module_name]
@@ -0,0 +1,129 @@
+"""
+Scale benchmark of the kvm_monitor collection cycle.
+
+Runs modules.kvm_monitor.collect_data() against benchmarks/fake_libvirt.py
+with N domains and writes through the real write pipeline to a local HTTP
+sink standing in for InfluxDB. Reports per cycle: wall time, libvirt RPCs,
+peak traced allocations and the points that reached the sink.
+
+    python benchmarks/bench_kvm_monitor.py --vms 10,100,1000 --cycles 5
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_libvirt
+from influx_sink import InfluxSink
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vms", default="10,100,1000", help="comma separated domain counts")
+    parser.add_argument("--cycles", type=int, default=5, help="timed cycles per domain count")
+    parser.add_argument("--disks", type=int, default=2, help="disks per domain")
+    parser.add_argument("--nics", type=int, default=2, help="interfaces per domain")
+    parser.add_argument("--vcpus", type=int, default=4, help="vCPUs per domain")
+    parser.add_argument("--per-domain", action="store_true", help="use the per-domain RPC path instead of getAllDomainStats")
+    return parser.parse_args()
+
+
+def setup(sink):
+    # everything below is read at import time by connection.py and kvm_monitor.py
+    os.environ.update({
+        "INFLUX_URL": sink.url,
+        "INFLUX_TOKEN": "bench",
+        "INFLUX_ORG": "bench",
+        "INFLUX_BUCKET": "bench",
+        "INFLUX_SPOOL_DIR": "",
+        "INFLUX_FLUSH_INTERVAL": "0.2",
+        "CPU_SAMPLES_CHECKPOINT": os.path.join(tempfile.mkdtemp(prefix="kvm-bench-"), "cpu_samples.json"),
+    })
+    os.chdir(ROOT)
+    sys.modules["libvirt"] = fake_libvirt
+
+    from modules import kvm_monitor
+    logging.getLogger("modules").setLevel(logging.WARNING)
+    return kvm_monitor
+
+
+def drain(write_pipeline, sink, timeout=60):
+    """Wait until every point queued so far reached the sink."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = write_pipeline.stats()
+        if stats["queue_depth"] == 0 and sink.points >= stats["written"]:
+            time.sleep(0.5)
+            if write_pipeline.stats()["written"] == stats["written"]:
+                return
+        time.sleep(0.05)
+    raise TimeoutError("write pipeline did not drain")
+
+
+def run(kvm_monitor, sink, vms, cycles):
+    from connection import write_pipeline
+
+    # the first cycle fills the connection, topology and cpu sample caches
+    kvm_monitor.collect_data()
+    drain(write_pipeline, sink)
+
+    durations, rpcs = [], []
+    points_before = sink.points
+    for _ in range(cycles):
+        fake_libvirt.reset_rpc_count()
+        started_at = time.perf_counter()
+        if not kvm_monitor.collect_data():
+            raise RuntimeError("collect_data failed, rerun with the modules logger at DEBUG")
+        durations.append(time.perf_counter() - started_at)
+        rpcs.append(fake_libvirt.rpc_count)
+    drain(write_pipeline, sink)
+    points = (sink.points - points_before) / cycles
+
+    # one extra cycle under tracemalloc, it slows everything down too much to time it
+    tracemalloc.start()
+    kvm_monitor.collect_data()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    drain(write_pipeline, sink)
+
+    cycle = sum(durations) / len(durations)
+    return {
+        "vms": vms,
+        "cycle_ms": cycle * 1000,
+        "max_ms": max(durations) * 1000,
+        "rpcs": sum(rpcs) / len(rpcs),
+        "points": points,
+        "points_per_sec": points / cycle if cycle else 0.0,
+        "peak_kib": peak / 1024,
+    }
+
+
+def main():
+    args = parse_args()
+    sink = InfluxSink().start()
+    kvm_monitor = setup(sink)
+    if args.per_domain:
+        kvm_monitor.BULK_STATS_SUPPORTED = False
+
+    columns = ("vms", "cycle_ms", "max_ms", "rpcs", "points", "points_per_sec", "peak_kib")
+    print(" ".join(f"{column:>14}" for column in columns))
+    try:
+        for vms in (int(count) for count in args.vms.split(",")):
+            fake_libvirt.configure(domains=vms, disks=args.disks, nics=args.nics, vcpus=args.vcpus)
+            result = run(kvm_monitor, sink, vms, args.cycles)
+            print(" ".join(f"{result[column]:>14.1f}" if isinstance(result[column], float)
+                           else f"{result[column]:>14}" for column in columns), flush=True)
+    finally:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
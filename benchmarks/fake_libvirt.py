@@ -0,0 +1,268 @@
+"""
+Stand-in for the libvirt python binding with a configurable number of domains.
+
+Only what modules/kvm_monitor.py uses is implemented. Every call that would be
+a round trip to libvirtd increments `rpc_count`, so a benchmark can tell how
+many RPCs a collection cycle needs.
+"""
+
+import threading
+import time
+
+VIR_DOMAIN_NOSTATE = 0
+VIR_DOMAIN_RUNNING = 1
+VIR_DOMAIN_BLOCKED = 2
+VIR_DOMAIN_PAUSED = 3
+VIR_DOMAIN_SHUTDOWN = 4
+VIR_DOMAIN_SHUTOFF = 5
+VIR_DOMAIN_CRASHED = 6
+VIR_DOMAIN_PMSUSPENDED = 7
+
+VIR_DOMAIN_STATS_STATE = 1
+VIR_DOMAIN_STATS_CPU_TOTAL = 2
+VIR_DOMAIN_STATS_BALLOON = 4
+VIR_DOMAIN_STATS_VCPU = 8
+VIR_DOMAIN_STATS_INTERFACE = 16
+VIR_DOMAIN_STATS_BLOCK = 32
+
+VIR_DOMAIN_EVENT_ID_LIFECYCLE = 0
+VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED = 15
+VIR_DOMAIN_EVENT_ID_DEVICE_ADDED = 19
+
+VIR_DOMAIN_EVENT_DEFINED = 0
+VIR_DOMAIN_EVENT_UNDEFINED = 1
+VIR_DOMAIN_EVENT_STARTED = 2
+VIR_DOMAIN_EVENT_SUSPENDED = 3
+VIR_DOMAIN_EVENT_RESUMED = 4
+VIR_DOMAIN_EVENT_STOPPED = 5
+VIR_DOMAIN_EVENT_SHUTDOWN = 6
+VIR_DOMAIN_EVENT_PMSUSPENDED = 7
+VIR_DOMAIN_EVENT_CRASHED = 8
+VIR_DOMAIN_EVENT_STARTED_MIGRATED = 1
+VIR_DOMAIN_EVENT_STOPPED_CRASHED = 2
+VIR_DOMAIN_EVENT_STOPPED_MIGRATED = 3
+VIR_DOMAIN_EVENT_STOPPED_FAILED = 5
+
+VIR_ERR_NO_SUPPORT = 3
+
+VIR_NODE_MEMORY_STATS_ALL_CELLS = -1
+
+rpc_count = 0
+_rpc_lock = threading.Lock()
+_layout = {"domains": 10, "disks": 2, "nics": 2, "vcpus": 4}
+
+
+class libvirtError(Exception):
+    def get_error_code(self):
+        return 0
+
+
+def configure(domains=10, disks=2, nics=2, vcpus=4):
+    """Set the shape of the domains every connection reports from now on."""
+    _layout.update(domains=domains, disks=disks, nics=nics, vcpus=vcpus)
+
+
+def reset_rpc_count():
+    global rpc_count
+    with _rpc_lock:
+        rpc_count = 0
+
+
+def _rpc():
+    global rpc_count
+    with _rpc_lock:
+        rpc_count += 1
+
+
+def virEventRegisterDefaultImpl():
+    pass
+
+
+def virEventRunDefaultImpl():
+    time.sleep(1)
+
+
+def open(uri):
+    _rpc()
+    return virConnect(uri)
+
+
+class virDomain:
+    def __init__(self, index):
+        self.index = index
+        self._uuid = f"00000000-0000-4000-8000-{index:012d}"
+        self._name = f"bench-vm-{index:04d}"
+
+    def _counter(self, scale=1):
+        # monotonically increasing, so usages and rates come out non-zero
+        return int(time.monotonic() * 1000000 * scale) + self.index
+
+    def name(self):
+        return self._name
+
+    def UUIDString(self):
+        return self._uuid
+
+    def ID(self):
+        return self.index + 1
+
+    def state(self, flags=0):
+        _rpc()
+        return [VIR_DOMAIN_RUNNING, 1]
+
+    def info(self):
+        _rpc()
+        return [VIR_DOMAIN_RUNNING, 8388608, 8388608, _layout["vcpus"], self._counter(1000)]
+
+    def XMLDesc(self, flags=0):
+        _rpc()
+        disks = ''.join(f"<disk type='file' device='disk'><source file='/var/lib/images/{self._name}-{i}.qcow2'/>"
+                        f"<target dev='vd{chr(97 + i)}'/></disk>" for i in range(_layout["disks"]))
+        nics = ''.join(f"<interface type='bridge'><target dev='vnet{self.index}_{i}'/></interface>"
+                       for i in range(_layout["nics"]))
+        return f"<domain><name>{self._name}</name><uuid>{self._uuid}</uuid><devices>{disks}{nics}</devices></domain>"
+
+    def getCPUStats(self, total):
+        _rpc()
+        return [{"cpu_time": self._counter(1000), "user_time": self._counter(600), "system_time": self._counter(300)}]
+
+    def vcpus(self):
+        _rpc()
+        return [[(i, 1, self._counter(250), i) for i in range(_layout["vcpus"])], []]
+
+    def memoryStats(self):
+        _rpc()
+        return {"actual": 8388608, "swap_in": 0, "swap_out": 0, "major_fault": 12, "minor_fault": self._counter(),
+                "unused": 4194304, "available": 8000000, "usable": 4000000, "rss": 4300000,
+                "last_update": int(time.time())}
+
+    def blockStats(self, path):
+        _rpc()
+        return (self._counter(0.01), self._counter(4), self._counter(0.02), self._counter(8), 0)
+
+    def blockStatsFlags(self, path, flags=0):
+        _rpc()
+        return {"rd_operations": self._counter(0.01), "rd_bytes": self._counter(4), "rd_total_times": self._counter(2),
+                "wr_operations": self._counter(0.02), "wr_bytes": self._counter(8), "wr_total_times": self._counter(3),
+                "flush_operations": self._counter(0.001), "flush_total_times": self._counter(1), "errs": 0}
+
+    def interfaceStats(self, path):
+        _rpc()
+        return (self._counter(10), self._counter(0.01), 0, 0, self._counter(5), self._counter(0.005), 0, 0)
+
+    def stats_record(self):
+        record = {
+            "state.state": VIR_DOMAIN_RUNNING,
+            "state.reason": 1,
+            "cpu.time": self._counter(1000),
+            "cpu.user": self._counter(600),
+            "cpu.system": self._counter(300),
+            "balloon.current": 8388608,
+            "balloon.maximum": 8388608,
+            "balloon.swap_in": 0,
+            "balloon.swap_out": 0,
+            "balloon.major_fault": 12,
+            "balloon.minor_fault": self._counter(),
+            "balloon.unused": 4194304,
+            "balloon.available": 8000000,
+            "balloon.usable": 4000000,
+            "balloon.rss": 4300000,
+            "balloon.last-update": int(time.time()),
+            "vcpu.current": _layout["vcpus"],
+            "vcpu.maximum": _layout["vcpus"],
+            "net.count": _layout["nics"],
+            "block.count": _layout["disks"],
+        }
+        for i in range(_layout["vcpus"]):
+            record[f"vcpu.{i}.state"] = 1
+            record[f"vcpu.{i}.time"] = self._counter(250)
+        for i in range(_layout["nics"]):
+            record.update({
+                f"net.{i}.name": f"vnet{self.index}_{i}",
+                f"net.{i}.rx.bytes": self._counter(10), f"net.{i}.rx.pkts": self._counter(0.01),
+                f"net.{i}.rx.errs": 0, f"net.{i}.rx.drop": 0,
+                f"net.{i}.tx.bytes": self._counter(5), f"net.{i}.tx.pkts": self._counter(0.005),
+                f"net.{i}.tx.errs": 0, f"net.{i}.tx.drop": 0,
+            })
+        for i in range(_layout["disks"]):
+            record.update({
+                f"block.{i}.name": f"vd{chr(97 + i)}",
+                f"block.{i}.path": f"/var/lib/images/{self._name}-{i}.qcow2",
+                f"block.{i}.rd.reqs": self._counter(0.01), f"block.{i}.rd.bytes": self._counter(4),
+                f"block.{i}.rd.times": self._counter(2),
+                f"block.{i}.wr.reqs": self._counter(0.02), f"block.{i}.wr.bytes": self._counter(8),
+                f"block.{i}.wr.times": self._counter(3),
+                f"block.{i}.fl.reqs": self._counter(0.001), f"block.{i}.fl.times": self._counter(1),
+                f"block.{i}.errors": 0,
+            })
+        return record
+
+
+class virConnect:
+    def __init__(self, uri):
+        self.uri = uri
+        self._domains = {}
+        self._alive = True
+        self._callbacks = {}
+
+    def _list(self):
+        count = _layout["domains"]
+        for index in range(count):
+            if index not in self._domains:
+                self._domains[index] = virDomain(index)
+        return [self._domains[index] for index in range(count)]
+
+    def isAlive(self):
+        return self._alive
+
+    def setKeepAlive(self, interval, count):
+        _rpc()
+
+    def registerCloseCallback(self, callback, opaque):
+        _rpc()
+
+    def unregisterCloseCallback(self):
+        _rpc()
+
+    def close(self):
+        self._alive = False
+
+    def domainEventRegisterAny(self, dom, event_id, callback, opaque):
+        _rpc()
+        callback_id = len(self._callbacks)
+        self._callbacks[callback_id] = (event_id, callback, opaque)
+        return callback_id
+
+    def domainEventDeregisterAny(self, callback_id):
+        _rpc()
+        self._callbacks.pop(callback_id, None)
+
+    def emit(self, event_id, index, *args):
+        """Deliver a domain event for domain `index` like libvirt's event loop would."""
+        for registered_id, callback, opaque in list(self._callbacks.values()):
+            if registered_id == event_id:
+                callback(self, self._list()[index], *args, opaque)
+
+    def getHostname(self):
+        _rpc()
+        return self.uri.rstrip('/').rpartition('/')[2] or "bench-host"
+
+    def getCapabilities(self):
+        _rpc()
+        return f"<capabilities><host><uuid>{abs(hash(self.uri)):032x}</uuid></host></capabilities>"
+
+    def getMemoryStats(self, cell, flags=0):
+        _rpc()
+        return {"total": 263729152, "free": 120000000, "buffers": 1000000, "cached": 40000000}
+
+    def getInfo(self):
+        _rpc()
+        return ["x86_64", 257552, 64, 3000, 2, 1, 16, 2]
+
+    def listAllDomains(self, flags=0):
+        _rpc()
+        return self._list()
+
+    def getAllDomainStats(self, stats=0, flags=0):
+        _rpc()
+        return [(domain, domain.stats_record()) for domain in self._list()]
@@ -0,0 +1,51 @@
+"""Local HTTP server accepting InfluxDB v2 writes, it only counts what it receives."""
+
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class InfluxSink:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.points = 0
+        self.requests = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = threading.Thread(target=self.server.serve_forever, name="influx-sink", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                sink.record(body, self.headers.get("Content-Encoding") == "gzip")
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def record(self, body, gzipped):
+        with self._lock:
+            self.requests += 1
+            self.bytes += len(body)
+            if gzipped:
+                body = gzip.decompress(body)
+            self.points += sum(1 for line in body.split(b'\n') if line.strip())
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
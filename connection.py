@@ -1,29 +1,236 @@
 import os
+import atexit
+import queue
+import threading
+import time
+import traceback
+
 import influxdb_client
 
 from dotenv import load_dotenv
 from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
 
+# before the local imports, spool.py reads its settings from the environment at import time
 load_dotenv()
 
+from instrumentation import COUNT_BUCKETS, self_metrics
+from line_protocol import encoder
+from modules import logger
+from spool import DiskSpool, INFLUX_SPOOL_DIR
+
 INFLUX_URL = os.getenv("INFLUX_URL")
 INFLUX_TOKEN = os.getenv("INFLUX_TOKEN")
 INFLUX_ORG = os.getenv("INFLUX_ORG")
 INFLUX_BUCKET = os.getenv("INFLUX_BUCKET")
 
-client = influxdb_client.InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
+# Write pipeline tuning
+INFLUX_BATCH_SIZE = int(os.getenv("INFLUX_BATCH_SIZE", 5000))
+INFLUX_FLUSH_INTERVAL = float(os.getenv("INFLUX_FLUSH_INTERVAL", 5))
+INFLUX_QUEUE_SIZE = int(os.getenv("INFLUX_QUEUE_SIZE", 50000))
+INFLUX_ENQUEUE_TIMEOUT = float(os.getenv("INFLUX_ENQUEUE_TIMEOUT", 0.5))
+
+# gzip the request bodies, urllib3 keeps the connection to influx alive between batches
+client = influxdb_client.InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG, enable_gzip=True)
 write_api = client.write_api(write_options=SYNCHRONOUS)
 
 
-def create_influxdb_point(measurement, data):
-    point = influxdb_client.Point(measurement)
-    for key, value in data.items():
-        if key == 'host':
-            # hotfix for dot in hostname
-            point = point.tag(key, value.split('.')[0])
-        elif key == 'vm_name':
-            point = point.tag(key, value)
-        else:
-            point = point.field(key, value)
+def is_retryable(error):
+    """True for failures worth spooling: connection errors, timeouts, 5xx and 429."""
+    if not isinstance(error, ApiException) or not error.status:
+        return True
+    return error.status >= 500 or error.status == 429
+
+
+class WritePipeline:
+    """
+    Shared write path for all collectors.
+
+    Collectors only enqueue records, encoded to line protocol with their
+    collection time. A background thread drains the bounded queue and writes them
+    to influx in batches, either when `batch_size` points are pending or every
+    `flush_interval` seconds.
+
+    With a `spool`, enqueue never blocks: points that don't fit in the queue and
+    batches that fail to write go to the disk spool, which is replayed once
+    writes succeed again. Without one, `enqueue` blocks for at most
+    `enqueue_timeout` seconds and then drops the point.
+    """
+
+    def __init__(self, batch_size=INFLUX_BATCH_SIZE, flush_interval=INFLUX_FLUSH_INTERVAL,
+                 max_queue_size=INFLUX_QUEUE_SIZE, enqueue_timeout=INFLUX_ENQUEUE_TIMEOUT, spool=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.spool = spool
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._healthy = True
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+                self._thread.start()
+
+    def write_record(self, measurement, record, timestamp=None):
+        """Encode `record` for `measurement` and enqueue it, `timestamp` is the collection time in ns."""
+        started_at = time.perf_counter()
+        line = encoder.encode(measurement, record, timestamp)
+        self_metrics.observe("write_pipeline", "encode_seconds", time.perf_counter() - started_at)
+        if line is None:
+            return False
+        self_metrics.add_point()
+        return self.enqueue(line)
+
+    def enqueue(self, line):
+        if self._thread is None:
+            self.start()
+        try:
+            if self.spool is not None:
+                self.queue.put_nowait(line)
+            else:
+                self.queue.put(line, timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            if self.spool is not None and self.spool.append([line]):
+                return True
+            with self._lock:
+                self.dropped += 1
+            logger.debug("Write queue full, dropping point")
+            return False
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "queue_depth": self.queue.qsize(),
+            }
+        if self.spool is not None:
+            stats.update(self.spool.stats())
+        return stats
+
+    def close(self, timeout=30):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        logger.info(f"Write pipeline stopped: {self.stats()}")
+
+    def _drain(self, batch, timeout):
+        try:
+            batch.append(self.queue.get(timeout=timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not self._stop.is_set():
+            self._drain(batch, timeout=max(0.0, min(deadline - time.monotonic(), 1.0)))
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self_metrics.observe("write_pipeline", "queue_depth", self.queue.qsize(), COUNT_BUCKETS)
+                if self._write(batch) and self.spool is not None and self.spool.has_data():
+                    self._replay()
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+        # flush whatever is left on shutdown
+        while True:
+            self._drain(batch, timeout=0)
+            if not batch:
+                break
+            self._write(batch)
+            batch = []
+
+    def _send(self, body):
+        write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=body)
+
+    def _deliver(self, batch):
+        """
+        Send `batch` and return how many of its points influx rejected for good.
+
+        Retryable errors are raised. A 413 splits the batch in halves, other
+        4xx (parse errors, field type conflicts) drop it, resending can't help.
+        """
+        try:
+            self._send(b'\n'.join(batch))
+            return 0
+        except ApiException as e:
+            if is_retryable(e):
+                raise
+            if e.status == 413 and len(batch) > 1:
+                # a retryable error in the second half resends the first, influx overwrites identical points
+                middle = len(batch) // 2
+                return self._deliver(batch[:middle]) + self._deliver(batch[middle:])
+            logger.error(f"influx rejected {len(batch)} points ({e.status} {e.reason}): {e.body}")
+            return len(batch)
+
+    def _count_rejected(self, rejected):
+        if rejected:
+            self_metrics.increment("write_pipeline", "rejected_points", rejected)
+            with self._lock:
+                self.dropped += rejected
+
+    def _write(self, batch):
+        if not batch:
+            # nothing to send, report how the last write went
+            return self._healthy
+        started_at = time.perf_counter()
+        try:
+            rejected = self._deliver(batch)
+            self_metrics.observe("write_pipeline", "write_seconds", time.perf_counter() - started_at)
+            self_metrics.observe("write_pipeline", "batch_points", len(batch), COUNT_BUCKETS)
+            self._count_rejected(rejected)
+            with self._lock:
+                self.written += len(batch) - rejected
+            self._healthy = True
+            return True
+        except Exception as e:
+            self_metrics.observe("write_pipeline", "write_seconds", time.perf_counter() - started_at)
+            self_metrics.increment("write_pipeline", "write_errors")
+            with self._lock:
+                self.failed += len(batch)
+            logger.error(f"Error writing {len(batch)} points to influx: {str(e)}")
+            logger.debug(traceback.format_exc())
+            self._healthy = False
+            if self.spool is not None:
+                self.spool.append(batch)
+            return False
+
+    def _replay_batch(self, body):
+        # rejected spooled points are dropped too, or one bad line would block the spool forever
+        self._count_rejected(self._deliver(body.splitlines()))
+
+    def _replay(self):
+        try:
+            self.spool.replay(self._replay_batch)
+        except Exception as e:
+            self._healthy = False
+            logger.error(f"Error replaying spooled points to influx: {str(e)}")
+            logger.debug(traceback.format_exc())
+
+
+def create_spool():
+    """Open the disk spool, the pipeline still runs without one if INFLUX_SPOOL_DIR isn't writable."""
+    if not INFLUX_SPOOL_DIR:
+        return None
+    try:
+        return DiskSpool()
+    except OSError as e:
+        logger.warning(f"Disk spool disabled, cannot use {INFLUX_SPOOL_DIR}: {e}")
+        return None
+
 
-    return point
+write_pipeline = WritePipeline(spool=create_spool())
+atexit.register(write_pipeline.close)
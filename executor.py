@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import logger
+
+COLLECTOR_WORKERS = int(os.getenv("COLLECTOR_WORKERS", 8))
+DRIFT_WARNING_SECONDS = float(os.getenv("DRIFT_WARNING_SECONDS", 5))
+
+
+class CollectorJob:
+    __slots__ = ("name", "target", "interval", "deadline", "future", "started_at", "overrun_reported",
+                 "runs", "skipped", "overruns", "last_duration", "last_drift")
+
+    def __init__(self, name, target, interval, deadline):
+        self.name = name
+        self.target = target
+        self.interval = interval
+        self.deadline = deadline
+        self.future = None
+        self.started_at = None
+        self.overrun_reported = False
+        self.runs = 0
+        self.skipped = 0
+        self.overruns = 0
+        self.last_duration = 0.0
+        self.last_drift = 0.0
+
+
+class CollectorExecutor:
+    """
+    Runs collectors on a thread pool so one slow module can't hold up the others.
+
+    A run is skipped when the previous run of the same module is still in progress,
+    `target(name, deadline)` is expected to drop its results when it finishes after
+    `deadline` (a time.monotonic() value), and the start time of every run is
+    compared with the previous one to report scheduling drift.
+    """
+
+    def __init__(self, max_workers=COLLECTOR_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="collector")
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, target, interval, deadline=None):
+        self.jobs[name] = CollectorJob(name, target, interval, deadline or interval)
+
+    def submit(self, name):
+        job = self.jobs[name]
+        with self._lock:
+            if job.future is not None and not job.future.done():
+                job.skipped += 1
+                logger.warning(f"Skipping {name}, previous run still in progress "
+                               f"({time.monotonic() - job.started_at:.1f}s)")
+                return
+            job.future = self.pool.submit(self._run, job, time.monotonic())
+
+    def _run(self, job, scheduled_at):
+        started_at = time.monotonic()
+        with self._lock:
+            if job.started_at is not None:
+                job.last_drift = started_at - job.started_at - job.interval
+                if abs(job.last_drift) > DRIFT_WARNING_SECONDS:
+                    logger.warning(f"{job.name} started {job.last_drift:+.1f}s off schedule "
+                                   f"(waited {started_at - scheduled_at:.1f}s for a worker)")
+            job.started_at = started_at
+            job.overrun_reported = False
+            job.runs += 1
+        try:
+            job.target(job.name, deadline=started_at + job.deadline)
+        except Exception:
+            logger.debug(traceback.format_exc())
+        finally:
+            job.last_duration = time.monotonic() - started_at
+
+    def check_deadlines(self):
+        now = time.monotonic()
+        with self._lock:
+            for job in self.jobs.values():
+                if job.future is None or job.future.done() or job.overrun_reported:
+                    continue
+                if now - job.started_at > job.deadline:
+                    job.overruns += 1
+                    job.overrun_reported = True
+                    logger.warning(f"{job.name} exceeded its {job.deadline}s deadline, results will be dropped")
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    "runs": job.runs,
+                    "skipped": job.skipped,
+                    "overruns": job.overruns,
+                    "last_duration": job.last_duration,
+                    "last_drift": job.last_drift,
+                }
+                for name, job in self.jobs.items()
+            }
+
+    def shutdown(self, wait=False):
+        self.pool.shutdown(wait=wait, cancel_futures=True)
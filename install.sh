@@ -11,29 +11,6 @@ fi
 
 cd /root 2>/dev/null
 
-# kvmtop installation
-echo "Installing kvmtop..."
-
-# Download kvmtop
-wget https://github.com/cha87de/kvmtop/releases/download/2.1.3/kvmtop_2.1.3_linux_amd64.deb
-
-# Install kvmtop
-dpkg -i kvmtop_2.1.3_linux_amd64.deb || true
-
-# Check and install missing dependencies
-echo "Checking and installing dependencies..."
-echo "deb http://security.ubuntu.com/ubuntu focal-security main" | tee -a /etc/apt/sources.list
-echo "deb http://archive.ubuntu.com/ubuntu/ focal main restricted universe multiverse" | tee -a /etc/apt/sources.list
-echo "deb http://archive.ubuntu.com/ubuntu/ focal-updates main restricted universe multiverse" | tee -a /etc/apt/sources.list
-echo "deb http://security.ubuntu.com/ubuntu/ focal-security main restricted universe multiverse" | tee -a /etc/apt/sources.list
-
-apt update
-apt upgrade -y
-apt install libncurses5 -y
-
-# Verify kvmtop installation
-kvmtop --version
-
 # Clone the kvm-monitor repository and set up
 echo "Cloning and setting up kvm-monitor..."
 git clone https://github.com/oneplay-internet/kvm-monitor.git
@@ -0,0 +1,144 @@
+import bisect
+import socket
+import threading
+import time
+
+from line_protocol import register_measurement
+
+SELF_MEASUREMENT = "kvm_monitor_self"
+
+# one record per component: a collector, or the write pipeline
+register_measurement(SELF_MEASUREMENT, ("host", "component"))
+
+# 100µs .. ~105s, doubling
+DURATION_BUCKETS = tuple(0.0001 * 2 ** i for i in range(21))
+# 0, then 1 .. ~1M, doubling
+COUNT_BUCKETS = (0.0,) + tuple(float(2 ** i) for i in range(21))
+
+
+class Histogram:
+    """Counts of observations per bucket, percentiles are read as the upper bound of their bucket."""
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        # always floats, influx rejects a field that changes type
+        value = float(value)
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def fields(self, prefix):
+        return {
+            f"{prefix}_count": self.count,
+            f"{prefix}_mean": self.total / self.count if self.count else 0.0,
+            f"{prefix}_max": self.max,
+            f"{prefix}_p50": self.percentile(0.5),
+            f"{prefix}_p95": self.percentile(0.95),
+            f"{prefix}_p99": self.percentile(0.99),
+        }
+
+
+class SelfMetrics:
+    """
+    In-process histograms and counters describing the agent itself.
+
+    Histograms cover one reporting interval and are reset by `collect`,
+    counters are cumulative. Written points are counted for the component
+    bound to the writing thread, threads a collector hands work to are bound
+    to it with `wrap`, so its points are counted whichever thread writes them.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._points = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, component, metric, value, bounds=DURATION_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get((component, metric))
+            if histogram is None:
+                histogram = self._histograms[(component, metric)] = Histogram(bounds)
+            histogram.observe(value)
+
+    def increment(self, component, counter, amount=1):
+        with self._lock:
+            self._counters[(component, counter)] = self._counters.get((component, counter), 0) + amount
+
+    def bind(self, component):
+        """Count the points written on this thread from now on for `component`."""
+        self._local.component = component
+
+    def wrap(self, function):
+        """Return `function` bound to this thread's component wherever it runs, for pools and helper threads."""
+        component = getattr(self._local, "component", None)
+
+        def bound(*args, **kwargs):
+            self.bind(component)
+            return function(*args, **kwargs)
+        return bound
+
+    def add_point(self):
+        component = getattr(self._local, "component", None)
+        with self._lock:
+            self._points[component] = self._points.get(component, 0) + 1
+
+    def count_points(self, component):
+        """Return the points written for `component`, on any thread, since the previous call."""
+        with self._lock:
+            return self._points.pop(component, 0)
+
+    def collect(self, gauges=None):
+        """Return one record per component and start a new interval, `gauges` maps component -> extra fields."""
+        hostname = socket.gethostname()
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+            counters = dict(self._counters)
+
+        records = {}
+        for component, fields in (gauges or {}).items():
+            records.setdefault(component, {}).update(fields)
+        for (component, counter), value in counters.items():
+            records.setdefault(component, {})[counter] = value
+        for (component, metric), histogram in histograms.items():
+            records.setdefault(component, {}).update(histogram.fields(metric))
+        return [dict(host=hostname, component=component, **fields) for component, fields in records.items()]
+
+
+self_metrics = SelfMetrics()
+
+
+class timed:
+    """Context manager recording its duration in seconds under `component` / `metric`."""
+    __slots__ = ("component", "metric", "started_at")
+
+    def __init__(self, component, metric):
+        self.component = component
+        self.metric = metric
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self_metrics.observe(self.component, self.metric, time.perf_counter() - self.started_at)
+        return False
@@ -0,0 +1,106 @@
+import math
+import threading
+import time
+
+HOST_TAGS = ("host", "host_uuid")
+VM_TAGS = HOST_TAGS + ("vm_name", "vm_id", "state")
+DEFAULT_TAGS = ("host", "vm_name")
+
+# measurement -> keys of a record that are written as tags, everything else is a field
+MEASUREMENT_TAGS = {
+    "cpustat": HOST_TAGS,
+    "memory": HOST_TAGS,
+    "disk": HOST_TAGS + ("disk",),
+    "nics": HOST_TAGS,
+    "psistat": HOST_TAGS,
+    "vm_cpustat": VM_TAGS,
+    "vm_memory": VM_TAGS,
+    "vm_disk": VM_TAGS + ("disk",),
+    "vm_interface": VM_TAGS + ("interface",),
+    "vm_nics": VM_TAGS,
+    "vm_iostat": VM_TAGS,
+    "partition": ("host", "device", "fstype"),
+    "vmstatus": ("host", "vmid", "status"),
+}
+
+MAX_CACHED_TAG_SETS = 10000
+
+_MEASUREMENT_ESCAPES = str.maketrans({',': '\\,', ' ': '\\ ', '\n': '\\n'})
+_KEY_ESCAPES = str.maketrans({',': '\\,', '=': '\\=', ' ': '\\ ', '\n': '\\n'})
+_STRING_ESCAPES = str.maketrans({'"': '\\"', '\\': '\\\\'})
+
+
+def register_measurement(measurement, tag_keys):
+    """Declare which keys of the records written to `measurement` are tags."""
+    MEASUREMENT_TAGS[measurement] = tuple(tag_keys)
+
+
+def format_field_value(value):
+    # bool first, it is a subclass of int
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return f'{value}i'
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return None
+        return repr(value)
+    return '"' + str(value).translate(_STRING_ESCAPES) + '"'
+
+
+class LineProtocolEncoder:
+    """
+    Turns record dicts into influx line protocol bytes.
+
+    The escaped `measurement,tag=value,...` prefix is cached per measurement and
+    tag values (i.e. per host and VM), so a record only costs formatting its
+    fields. The `host` tag is cut at the first dot, as it always was.
+    """
+
+    def __init__(self):
+        self._prefixes = {}
+        self._lock = threading.Lock()
+
+    def _prefix(self, measurement, tag_keys, record):
+        tag_values = tuple(record.get(key) for key in tag_keys)
+        cache_key = (measurement, tag_values)
+        prefix = self._prefixes.get(cache_key)
+        if prefix is not None:
+            return prefix
+
+        tags = []
+        for key, value in sorted(zip(tag_keys, tag_values)):
+            if value is None or value == '':
+                continue
+            value = str(value)
+            if key == 'host':
+                # hotfix for dot in hostname
+                value = value.split('.')[0]
+            tags.append(f"{key.translate(_KEY_ESCAPES)}={value.translate(_KEY_ESCAPES)}")
+        prefix = ','.join([measurement.translate(_MEASUREMENT_ESCAPES)] + tags)
+
+        with self._lock:
+            if len(self._prefixes) >= MAX_CACHED_TAG_SETS:
+                self._prefixes.clear()
+            self._prefixes[cache_key] = prefix
+        return prefix
+
+    def encode(self, measurement, record, timestamp=None):
+        """Return the line for `record`, or None when it has no fields. `timestamp` is in ns."""
+        tag_keys = MEASUREMENT_TAGS.get(measurement, DEFAULT_TAGS)
+        fields = []
+        for key, value in record.items():
+            if value is None or key in tag_keys:
+                continue
+            value = format_field_value(value)
+            if value is not None:
+                fields.append(f"{key.translate(_KEY_ESCAPES)}={value}")
+        if not fields:
+            return None
+        if timestamp is None:
+            timestamp = time.time_ns()
+        line = f"{self._prefix(measurement, tag_keys, record)} {','.join(fields)} {timestamp}"
+        return line.encode('utf-8')
+
+
+encoder = LineProtocolEncoder()
@@ -1,24 +1,25 @@
 import os
+import sys
 import time
 import json
+import signal
 import importlib
+import threading
 import traceback
 
 import schedule
 
-from connection import create_influxdb_point, write_api, INFLUX_BUCKET, INFLUX_ORG
-from modules import MONITORING_INTERVAL, logger
-
-# Try to import libvirt to check if it's available
-try:
-    import libvirt
-    LIBVIRT_AVAILABLE = True
-except ImportError:
-    LIBVIRT_AVAILABLE = False
+from aggregation import get_aggregator, get_sample_interval
+from connection import write_pipeline
+from executor import CollectorExecutor
+from instrumentation import COUNT_BUCKETS, SELF_MEASUREMENT, self_metrics, timed
+from modules import MONITORING_INTERVAL, MODULES_CONFIG_PATH, get_module_settings, logger
+from registry import probe_collectors
+from suppression import get_suppressor
 
 
 def load_config():
-    with open('config/modules_config.json', 'r') as f:
+    with open(MODULES_CONFIG_PATH, 'r') as f:
         config = json.load(f)
 
     # Get modules - handle both string format and dict format
@@ -30,51 +31,114 @@ def load_config():
     else:
         module_names = modules
 
-    # Filter out kvm_monitor if libvirt is not available
-    if not LIBVIRT_AVAILABLE and "kvm_monitor" in module_names:
-        module_names = [m for m in module_names if m != "kvm_monitor"]
-        logger.warning("libvirt not available. Disabling kvm_monitor module.")
-
-    return module_names
+    # Disable the modules this host can't run once, instead of failing every cycle
+    return probe_collectors(module_names)
 
 
-def run_module(module_name):
+def run_module(module_name, deadline=None):
+    self_metrics.bind(module_name)
     try:
+        # probe_collectors already imported the module, disabled ones never are
         module = importlib.import_module(f"modules.{module_name}")
-        data = module.collect_data()
+        timestamp = time.time_ns()
+        with timed(module_name, "collect_seconds"):
+            data = module.collect_data()
 
-        if module_name == 'kvm_monitor' and not LIBVIRT_AVAILABLE:
+        if deadline is not None and time.monotonic() > deadline:
+            self_metrics.increment(module_name, "late_results")
+            logger.warning(f"Dropping late results of module {module_name}")
             return
-            
+
         if data:
-            if isinstance(data, list):
-                # If collect data return multiple records
-                for record in data:
-                    point = create_influxdb_point(module_name, record)
-                    write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point)
-            else:
-                point = create_influxdb_point(module_name, data)
-                write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point)
+            # If collect data return multiple records
+            records = data if isinstance(data, list) else [data]
+            aggregator = get_aggregator(module_name)
+            suppressor = get_suppressor(module_name)
+            for record in records:
+                # kvm_monitor writes its own measurements and only reports success
+                if not isinstance(record, dict):
+                    continue
+                if aggregator is not None:
+                    record = aggregator.add(module_name, record)
+                    if not record:
+                        continue
+                if suppressor is not None:
+                    record = suppressor.filter(module_name, record)
+                    if not record:
+                        continue
+                write_pipeline.write_record(module_name, record, timestamp)
     except Exception as e:
+        self_metrics.increment(module_name, "errors")
         logger.error(f"Error running module {module_name}: {str(e)}")
         logger.debug(traceback.format_exc())
+    finally:
+        # includes the points collectors like kvm_monitor write themselves, on their own
+        # threads too, event driven ones are counted with the next run
+        self_metrics.observe(module_name, "points", self_metrics.count_points(module_name), COUNT_BUCKETS)
+
+
+def run_continuously(module_name):
+    """Thread target for collect_data_continuously(), restarted after a failure."""
+    self_metrics.bind(module_name)
+    module = importlib.import_module(f"modules.{module_name}")
+    while True:
+        try:
+            # blocks for as long as the module follows its source, returns when it has nothing to follow
+            module.collect_data_continuously()
+            return
+        except Exception as e:
+            self_metrics.increment(module_name, "errors")
+            logger.error(f"Continuous collector {module_name} failed, restarting in {MONITORING_INTERVAL}s: {e}")
+            logger.debug(traceback.format_exc())
+        time.sleep(MONITORING_INTERVAL)
 
 
+def publish_self_metrics(executor):
+    gauges = dict(executor.stats())
+    gauges["write_pipeline"] = write_pipeline.stats()
+    for record in self_metrics.collect(gauges):
+        write_pipeline.write_record(SELF_MEASUREMENT, record)
+
+
+def handle_shutdown(signum, frame):
+    logger.info(f"Received signal {signum}, shutting down")
+    # atexit flushes the pending points in the write pipeline
+    sys.exit(0)
+
 
 def main():
     logger.info("Starting monitoring service")
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    write_pipeline.start()
     modules = load_config()
-    
-    if not LIBVIRT_AVAILABLE and "kvm_monitor" in modules:
-        logger.warning("KVM monitor module is configured but libvirt is not available")
-    
+
+    executor = CollectorExecutor()
+    intervals = [MONITORING_INTERVAL]
     for module in modules:
-        schedule.every(MONITORING_INTERVAL).seconds.do(run_module, module)
-        logger.info(f"Scheduled {module} module")
+        collector = importlib.import_module(f"modules.{module}")
+        if hasattr(collector, "collect_data_continuously"):
+            # log followers like vmstatus feed the write pipeline as lines arrive
+            threading.Thread(target=run_continuously, args=(module,), name=f"{module}-continuous",
+                             daemon=True).start()
+            logger.info(f"Started continuous collection of {module}")
+        if not hasattr(collector, "collect_data"):
+            continue
+        # modules with pre-aggregation are sampled faster and ship one summary per window
+        interval = get_sample_interval(module, MONITORING_INTERVAL)
+        deadline = get_module_settings(module).get("deadline_seconds")
+        executor.register(module, run_module, interval=interval, deadline=deadline)
+        schedule.every(interval).seconds.do(executor.submit, module)
+        intervals.append(interval)
+        logger.info(f"Scheduled {module} module every {interval}s")
+    schedule.every(MONITORING_INTERVAL).seconds.do(publish_self_metrics, executor)
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    try:
+        while True:
+            schedule.run_pending()
+            executor.check_deadlines()
+            time.sleep(min(1, min(intervals)))
+    finally:
+        executor.shutdown()
 
 
 if __name__ == "__main__":
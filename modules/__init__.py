@@ -1,7 +1,9 @@
+import json
 import logging
 import os
 
 MONITORING_INTERVAL = 30
+MODULES_CONFIG_PATH = 'config/modules_config.json'
 
 if not os.path.exists('./logs'):
     os.makedirs('logs')
@@ -17,4 +19,18 @@ logging.basicConfig(
 )
 
 # Create a logger instance
-logger = logging.getLogger(__name__)
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+
+def get_module_settings(module_name):
+    """Return the dict entry for `module_name` from the modules config, or {}."""
+    try:
+        with open(MODULES_CONFIG_PATH, 'r') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        logger.debug(f"Could not read {MODULES_CONFIG_PATH}")
+        return {}
+    for module in config.get("modules", []):
+        if isinstance(module, dict) and module.get("name") == module_name:
+            return module
+    return {}
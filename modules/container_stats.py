@@ -2,6 +2,8 @@ import psutil
 import os
 from modules import logger
 
+REQUIREMENTS = {"python_modules": ("psutil",)}
+
 def collect_data():
     """Collect container-specific resource metrics"""
     try:
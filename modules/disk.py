@@ -1,25 +1,41 @@
 import os
+import re
+import glob
 import socket
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import ujson
 from modules import logger
 
+REQUIREMENTS = {"binaries": ("sudo", "smartctl"), "python_modules": ("ujson",), "paths": ("/sys/block",)}
+
+SMART_CACHE_TTL = float(os.getenv("SMART_CACHE_TTL", 300))
+# drives without a hwmon sensor need smartctl for their temperature too
+SMART_TEMPERATURE_TTL = float(os.getenv("SMART_TEMPERATURE_TTL", 120))
+SMART_CONCURRENCY = int(os.getenv("SMART_CONCURRENCY", 4))
+
+NVME_NAMESPACE = re.compile(r'^nvme\d+n\d+$')
+
+_smart_pool = ThreadPoolExecutor(max_workers=SMART_CONCURRENCY, thread_name_prefix="smartctl")
+_smart_cache = {}
+_temperature_cache = {}
+_smart_cache_lock = threading.Lock()
+
 def get_nvme_disk_names():
+    # /sys/block only lists whole disks, the regex skips multipath controller paths (nvme0c0n1)
     try:
-        command_output = subprocess.check_output(['lsblk', '-o', 'NAME,SIZE,MOUNTPOINT'])
-        output_string = command_output.decode('utf-8')
-        lines = output_string.split('\n')
-        nvme_disks = [line.split()[0] for line in lines if 'nvme' in line]
-        return nvme_disks
-
-    except subprocess.CalledProcessError as e:
+        return sorted(name for name in os.listdir('/sys/block') if NVME_NAMESPACE.match(name))
+    except OSError as e:
         logger.debug(f"Error: {e}")
         return []
 
-def get_disk_stats(disk_path):
+def get_disk_stats(disk_path, option='-a'):
     try:
         output = subprocess.check_output(
-            ['sudo', 'smartctl', '-j', '-a', disk_path], text=True)
+            ['sudo', 'smartctl', '-j', option, disk_path], text=True)
         if output and output.startswith('{ "'):
             data = ujson.loads(output)
             return data
@@ -32,17 +48,65 @@ def get_disk_stats(disk_path):
         logger.debug(str(e))
     return {}
 
+def get_cached_disk_stats(disk_path):
+    """Return (smartctl data, True if it was just read) and cache it without the temperature."""
+    # wear, power-on hours and spare capacity move slowly, don't run smartctl every cycle
+    now = time.monotonic()
+    with _smart_cache_lock:
+        cached = _smart_cache.get(disk_path)
+    if cached is not None and now - cached[0] < SMART_CACHE_TTL:
+        return cached[1], False
+
+    smart_data = get_disk_stats(disk_path)
+    if smart_data:
+        with _smart_cache_lock:
+            _smart_cache[disk_path] = (now, {key: value for key, value in smart_data.items() if key != 'temperature'})
+    return smart_data, True
+
+def read_hwmon_temperature(disk_path):
+    """Drive temperature in °C from sysfs (nvme, or drivetemp for SATA), None when there is no sensor."""
+    name = os.path.basename(disk_path)
+    # nvme controllers register hwmon directly below the device, drivetemp in a hwmon/ subdirectory
+    for path in sorted(glob.glob(f'/sys/block/{name}/device/hwmon*/temp1_input') +
+                       glob.glob(f'/sys/block/{name}/device/hwmon/hwmon*/temp1_input')):
+        try:
+            with open(path, 'r') as f:
+                return int(f.read()) // 1000
+        except (OSError, ValueError):
+            continue
+    return None
+
+def get_disk_temperature(disk_path, smart_data, refreshed):
+    # cached apart from the other attributes, it moves faster than wear or power-on hours
+    temperature = read_hwmon_temperature(disk_path)
+    if temperature is not None:
+        return temperature
+
+    now = time.monotonic()
+    if not refreshed:
+        with _smart_cache_lock:
+            cached = _temperature_cache.get(disk_path)
+        if cached is not None and now - cached[0] < SMART_TEMPERATURE_TTL:
+            return cached[1]
+        # -A only reads the attributes / health log, much cheaper than a full -a
+        smart_data = get_disk_stats(disk_path, '-A')
+    temperature = smart_data.get('temperature', {}).get('current', 0)
+    if smart_data:
+        with _smart_cache_lock:
+            _temperature_cache[disk_path] = (now, temperature)
+    return temperature
+
 def get_smartctl_data(disk_path):
 
     if disk_path is None:
         # Silently return None if DISK_PATH is not set (expected when STORAGE_SERVER is used)
         return None
 
-    smart_data = get_disk_stats(disk_path)
+    smart_data, refreshed = get_cached_disk_stats(disk_path)
 
     # Extract relevant values from the JSON data
     hostname = socket.gethostname()
-    temperature = smart_data.get('temperature', {}).get('current', 0)
+    temperature = get_disk_temperature(disk_path, smart_data, refreshed)
     available_spare = smart_data.get('nvme_smart_health_information_log', {}).get('available_spare', 0)
     percentage_used = smart_data.get('nvme_smart_health_information_log', {}).get('percentage_used', 0)
     data_units_read = smart_data.get('nvme_smart_health_information_log', {}).get('data_units_read', 0)
@@ -71,15 +135,23 @@ def get_smartctl_data(disk_path):
     }
 
 
+def probe():
+    """smartctl runs through sudo every cycle, which has to work without a password prompt."""
+    try:
+        subprocess.run(['sudo', '-n', 'smartctl', '--version'], check=True, timeout=10,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return "sudo -n smartctl failed, passwordless sudo for smartctl is required"
+    except subprocess.TimeoutExpired:
+        return "sudo -n smartctl timed out"
+    return None
+
+
 def collect_data():
     try:
         if os.getenv("STORAGE_SERVER"):
             disks = get_nvme_disk_names()
-            disk_data = []
-            for disk in disks:
-                disk_data.append(get_smartctl_data(f"/dev/{disk}"))
-
-            return disk_data
+            return list(_smart_pool.map(get_smartctl_data, [f"/dev/{disk}" for disk in disks]))
 
         disk_path = os.getenv("DISK_PATH")
         return get_smartctl_data(disk_path)
@@ -1,11 +1,13 @@
 import os
-import subprocess
+import json
+import atexit
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from threading import Thread
+from urllib.parse import urlparse
 from xml.etree import ElementTree
 
-import inotify.adapters
-import psutil
-
 # Try to import libvirt, but handle if it's not available
 try:
     import libvirt
@@ -15,12 +17,64 @@ except ImportError:
     print("Warning: libvirt not available. KVM monitoring will be disabled.")
     libvirt = None
 
-import ujson
 import time
 import traceback
 
-from connection import create_influxdb_point, write_api, INFLUX_BUCKET, INFLUX_ORG
-from modules import MONITORING_INTERVAL, logger
+from aggregation import get_aggregator
+from connection import write_pipeline
+from instrumentation import self_metrics
+from line_protocol import register_measurement
+from modules import logger
+from modules.procfs import read_diskstats, read_meminfo, read_net_dev_cached, read_pressure, read_proc_stat
+from suppression import get_suppressor
+
+LIBVIRT_URI = os.getenv("LIBVIRT_URI", "qemu:///system")
+
+
+def parse_libvirt_uris(value):
+    """
+    Split a comma separated LIBVIRT_URIS into the uris and their host tags, an
+    entry may be given as alias=uri to tag a hypervisor with alias.
+    """
+    uris, aliases = [], {}
+    for entry in value.split(","):
+        alias, sep, uri = entry.partition("=")
+        # an = inside the uri (a query parameter) is not an alias
+        if not sep or "://" in alias or "://" not in uri:
+            alias, uri = "", entry
+        uri = uri.strip()
+        if uri:
+            uris.append(uri)
+            if alias.strip():
+                aliases[uri] = alias.strip()
+    return uris, aliases
+
+
+# comma separated, one agent can poll several hypervisors
+LIBVIRT_URIS, LIBVIRT_HOST_ALIASES = parse_libvirt_uris(os.getenv("LIBVIRT_URIS", LIBVIRT_URI))
+LIBVIRT_POLL_WORKERS = int(os.getenv("LIBVIRT_POLL_WORKERS", 8))
+LIBVIRT_POLL_TIMEOUT = float(os.getenv("LIBVIRT_POLL_TIMEOUT", 25))
+LIBVIRT_KEEPALIVE_INTERVAL = int(os.getenv("LIBVIRT_KEEPALIVE_INTERVAL", 5))
+LIBVIRT_KEEPALIVE_COUNT = int(os.getenv("LIBVIRT_KEEPALIVE_COUNT", 3))
+LIBVIRT_RECONNECT_MAX_BACKOFF = float(os.getenv("LIBVIRT_RECONNECT_MAX_BACKOFF", 60))
+# ujson and inotify are only needed to follow KVM_STATS_LOG and are imported there
+REQUIREMENTS = {"python_modules": ("libvirt",)}
+
+CPU_SAMPLES_CHECKPOINT = os.getenv("CPU_SAMPLES_CHECKPOINT", "/var/lib/kvm-monitor/cpu_samples.json")
+# kvmtop json stats log followed by collect_data_continuously, unset by default
+KVM_STATS_LOG = os.getenv("KVM_STATS_LOG")
+
+# one point per lifecycle event, at the time libvirt delivered it
+register_measurement('vm_lifecycle', ("host", "vm_name", "vm_id", "event"))
+
+# getAllDomainStats block.<n>.* / net.<n>.* counters kept per device, times are in ns
+BLOCK_COUNTERS = ("rd.reqs", "rd.bytes", "rd.times", "wr.reqs", "wr.bytes", "wr.times", "fl.reqs", "fl.times", "errors")
+NET_COUNTERS = ("rx.bytes", "rx.pkts", "rx.errs", "rx.drop", "tx.bytes", "tx.pkts", "tx.errs", "tx.drop")
+# blockStatsFlags() keys of the per-domain path, in BLOCK_COUNTERS order
+BLOCK_STATS_FLAGS_KEYS = ("rd_operations", "rd_bytes", "rd_total_times", "wr_operations", "wr_bytes",
+                          "wr_total_times", "flush_operations", "flush_total_times", "errs")
+# not reported by blockStats() nor by every driver, left out rather than reported as 0
+OPTIONAL_BLOCK_COUNTERS = ("rd.times", "wr.times", "fl.reqs", "fl.times")
 
 # Only define VM_STATE_DEFINITION if libvirt is available
 if LIBVIRT_AVAILABLE:
@@ -34,45 +88,766 @@ if LIBVIRT_AVAILABLE:
         libvirt.VIR_DOMAIN_CRASHED: "crashed",
         libvirt.VIR_DOMAIN_PMSUSPENDED: "pmsuspended",
     }
+    # lifecycle event -> (event name, state the domain is in afterwards), None keeps the state
+    LIFECYCLE_EVENTS = {
+        libvirt.VIR_DOMAIN_EVENT_DEFINED: ("define", None),
+        libvirt.VIR_DOMAIN_EVENT_UNDEFINED: ("undefine", None),
+        libvirt.VIR_DOMAIN_EVENT_STARTED: ("start", "running"),
+        libvirt.VIR_DOMAIN_EVENT_SUSPENDED: ("pause", "paused"),
+        libvirt.VIR_DOMAIN_EVENT_RESUMED: ("resume", "running"),
+        libvirt.VIR_DOMAIN_EVENT_STOPPED: ("stop", "shutoff"),
+        libvirt.VIR_DOMAIN_EVENT_SHUTDOWN: ("shutdown", "shutdown"),
+        libvirt.VIR_DOMAIN_EVENT_PMSUSPENDED: ("pmsuspend", "pmsuspended"),
+        libvirt.VIR_DOMAIN_EVENT_CRASHED: ("crash", "crashed"),
+    }
+    # (event, detail) that deserve a more specific name
+    LIFECYCLE_EVENT_DETAILS = {
+        (libvirt.VIR_DOMAIN_EVENT_STARTED, libvirt.VIR_DOMAIN_EVENT_STARTED_MIGRATED): "migrate",
+        (libvirt.VIR_DOMAIN_EVENT_STOPPED, libvirt.VIR_DOMAIN_EVENT_STOPPED_MIGRATED): "migrate",
+        (libvirt.VIR_DOMAIN_EVENT_STOPPED, libvirt.VIR_DOMAIN_EVENT_STOPPED_CRASHED): "crash",
+        (libvirt.VIR_DOMAIN_EVENT_STOPPED, libvirt.VIR_DOMAIN_EVENT_STOPPED_FAILED): "crash",
+    }
 else:
     VM_STATE_DEFINITION = {}
+    LIFECYCLE_EVENTS = {}
+    LIFECYCLE_EVENT_DETAILS = {}
 
+_event_loop_thread = None
+_event_loop_lock = threading.Lock()
+
+
+def start_libvirt_event_loop():
+    # keepalive and close/domain callbacks are only dispatched while an event loop runs
+    global _event_loop_thread
+    with _event_loop_lock:
+        if _event_loop_thread is not None:
+            return
+
+        def run_event_loop():
+            # lifecycle points are written from this thread
+            self_metrics.bind("kvm_monitor")
+            while True:
+                libvirt.virEventRunDefaultImpl()
+
+        libvirt.virEventRegisterDefaultImpl()
+        _event_loop_thread = Thread(target=run_event_loop, name="libvirt-events", daemon=True)
+        _event_loop_thread.start()
+
+
+class LibvirtConnection:
+    """
+    Long-lived libvirt connection shared by every collector thread.
+
+    `get()` returns the open handle and transparently reconnects when the
+    connection was closed or stopped answering keepalives. Failed reconnects
+    back off exponentially up to LIBVIRT_RECONNECT_MAX_BACKOFF seconds, calls
+    made during the backoff window raise ConnectionError without touching libvirt.
+    """
+
+    def __init__(self, uri):
+        self.uri = uri
+        self._conn = None
+        self._closed = False
+        self._lock = threading.RLock()
+        self._backoff = 1.0
+        self._next_attempt = 0.0
+        self._connect_callbacks = []
+
+    def get(self):
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    if not self._closed and self._conn.isAlive():
+                        return self._conn
+                except libvirt.libvirtError:
+                    pass
+                logger.warning(f"libvirt connection to {self.uri} lost, reconnecting")
+                self._discard()
+
+            now = time.monotonic()
+            if now < self._next_attempt:
+                raise ConnectionError(f"libvirt {self.uri} unavailable, next reconnect in "
+                                      f"{self._next_attempt - now:.0f}s")
+            try:
+                conn = libvirt.open(self.uri)
+            except libvirt.libvirtError:
+                self._next_attempt = now + self._backoff
+                self._backoff = min(self._backoff * 2, LIBVIRT_RECONNECT_MAX_BACKOFF)
+                raise
+            self._backoff = 1.0
+            self._next_attempt = 0.0
+
+            try:
+                conn.setKeepAlive(LIBVIRT_KEEPALIVE_INTERVAL, LIBVIRT_KEEPALIVE_COUNT)
+                conn.registerCloseCallback(self._on_close, None)
+            except libvirt.libvirtError:
+                logger.debug(traceback.format_exc())
+
+            self._conn = conn
+            self._closed = False
+            logger.info(f"Connected to libvirt {self.uri}")
+            for callback in self._connect_callbacks:
+                try:
+                    callback(conn)
+                except Exception:
+                    logger.debug(traceback.format_exc())
+            return conn
+
+    def on_connect(self, callback):
+        # run `callback(conn)` after every (re)connect, e.g. to register domain events
+        with self._lock:
+            self._connect_callbacks.append(callback)
+            if self._conn is not None:
+                callback(self._conn)
+
+    def close(self):
+        with self._lock:
+            self._discard()
+
+    def _discard(self):
+        if self._conn is not None:
+            try:
+                self._conn.unregisterCloseCallback()
+            except libvirt.libvirtError:
+                pass
+            try:
+                self._conn.close()
+            except libvirt.libvirtError:
+                logger.debug(traceback.format_exc())
+        self._conn = None
+
+    def _on_close(self, conn, reason, opaque):
+        # runs on the event loop thread, the handle is released on the next get()
+        logger.warning(f"libvirt connection to {self.uri} closed (reason {reason})")
+        self._closed = True
+
+
+class DomainTopology:
+    __slots__ = ("domain_id", "disks", "interfaces")
+
+    def __init__(self, domain_id, disks, interfaces):
+        self.domain_id = domain_id
+        self.disks = disks
+        self.interfaces = interfaces
+
+
+def _stale_keys(entries, uuids, scope):
+    # keys are (scope, uuid), a scope (the hypervisor URI) only prunes the domains it reported itself
+    uuids = set(uuids)
+    return [key for key in entries if key[0] == scope and key[1] not in uuids]
+
+
+class DomainTopologyCache:
+    """
+    Disk and interface target devices parsed from the domain XML,
+    keyed by hypervisor URI and domain UUID. An entry is re-parsed when the
+    domain ID changes (the domain was restarted) or a device hot-plug event
+    invalidates it.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, vm, scope):
+        key, domain_id = (scope, vm.UUIDString()), vm.ID()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry.domain_id == domain_id:
+            return entry
+
+        tree = ElementTree.fromstring(vm.XMLDesc())
+        # target names work for file, block and network disks alike, cdroms have no stats
+        disks = [target.get("dev") for target in tree.findall("devices/disk[@device='disk']/target")]
+        interfaces = [target.get("dev") for target in tree.findall("devices/interface/target")]
+        entry = DomainTopology(domain_id, disks, interfaces)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self, scope, uuid):
+        with self._lock:
+            self._entries.pop((scope, uuid), None)
+
+    def prune(self, uuids, scope):
+        # forget domains that no longer exist on this hypervisor
+        with self._lock:
+            for key in _stale_keys(self._entries, uuids, scope):
+                del self._entries[key]
+
+    def register_events(self, conn, scope):
+        for event_id in (libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_ADDED, libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED):
+            conn.domainEventRegisterAny(None, event_id, self._on_device_event, scope)
+
+    def _on_device_event(self, conn, dom, dev, scope):
+        logger.debug(f"Device {dev} changed on {dom.name()}, invalidating cached topology")
+        self.invalidate(scope, dom.UUIDString())
+
+
+domain_topology_cache = DomainTopologyCache()
+
+
+class CpuSample:
+    __slots__ = ("timestamp", "cpu_time", "vcpu_times")
+
+    def __init__(self, timestamp, cpu_time, vcpu_times):
+        self.timestamp = timestamp
+        self.cpu_time = cpu_time
+        self.vcpu_times = vcpu_times
+
+
+class CpuSampleStore:
+    """
+    Last CPU time sample of every domain, keyed by hypervisor URI and domain UUID.
+
+    `update()` stores the new sample and returns the total and per-vCPU usage
+    in percent since the previous one, timed with time.monotonic(). The store
+    is written to a single checkpoint file on shutdown and loaded again on
+    start, so the first cycle after a restart still reports usage.
+    """
+
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def update(self, scope, uuid, cpu_time, vcpu_times):
+        now = time.monotonic()
+        sample = CpuSample(now, cpu_time, vcpu_times)
+        with self._lock:
+            previous = self._samples.get((scope, uuid))
+            self._samples[(scope, uuid)] = sample
+
+        no_v_cpus = len(vcpu_times)
+        if previous is None or cpu_time < previous.cpu_time or not no_v_cpus:
+            # first sample or the domain was restarted
+            return 0.0, [0.0] * no_v_cpus
+        duration = now - previous.timestamp
+        if duration <= 0:
+            return 0.0, [0.0] * no_v_cpus
+
+        cpu_usage = (cpu_time - previous.cpu_time) / (duration * no_v_cpus) * 100
+        if len(previous.vcpu_times) == no_v_cpus:
+            vcpu_usage = [max(0.0, (current - last) / duration * 100)
+                          for current, last in zip(vcpu_times, previous.vcpu_times)]
+        else:
+            # vCPUs were hot-plugged since the last sample
+            vcpu_usage = [0.0] * no_v_cpus
+        return cpu_usage, vcpu_usage
+
+    def prune(self, uuids, scope):
+        with self._lock:
+            for key in _stale_keys(self._samples, uuids, scope):
+                del self._samples[key]
+
+    def checkpoint(self):
+        # monotonic clocks don't survive a restart, persist the samples in wall clock time
+        offset = time.time() - time.monotonic()
+        data = {}
+        with self._lock:
+            for (scope, uuid), sample in self._samples.items():
+                data.setdefault(scope, {})[uuid] = [sample.timestamp + offset, sample.cpu_time, sample.vcpu_times]
+        try:
+            os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+            with open(self.checkpoint_path, 'w') as f:
+                json.dump(data, f)
+        except OSError:
+            logger.debug(traceback.format_exc())
+
+    def load(self):
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            logger.debug(traceback.format_exc())
+            return
+        offset = time.time() - time.monotonic()
+        try:
+            samples = {(scope, uuid): CpuSample(timestamp - offset, cpu_time, vcpu_times)
+                       for scope, domains in data.items()
+                       for uuid, (timestamp, cpu_time, vcpu_times) in domains.items()}
+        except (AttributeError, TypeError, ValueError):
+            # written by an older version, start over
+            logger.debug(traceback.format_exc())
+            return
+        with self._lock:
+            self._samples.update(samples)
+
+
+cpu_sample_store = CpuSampleStore(CPU_SAMPLES_CHECKPOINT)
+cpu_sample_store.load()
+atexit.register(cpu_sample_store.checkpoint)
+
+
+class DeviceCounterStore:
+    """
+    Last counters of every VM disk and interface, keyed by hypervisor URI, domain UUID and device.
+
+    `delta()` stores the new counters and returns the seconds elapsed and the
+    increase of every counter since the previous call, or None for the first
+    sample and after a counter went backwards (the domain was restarted).
+    """
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def delta(self, scope, uuid, device, counters, now):
+        with self._lock:
+            devices = self._samples.setdefault((scope, uuid), {})
+            previous = devices.get(device)
+            devices[device] = (now, counters)
+        if previous is None or now <= previous[0]:
+            return None
+        # a counter the previous sample didn't have has no delta yet
+        deltas = {key: value - previous[1][key] for key, value in counters.items() if key in previous[1]}
+        if any(value < 0 for value in deltas.values()):
+            return None
+        return now - previous[0], deltas
+
+    def prune(self, uuids, scope):
+        with self._lock:
+            for key in _stale_keys(self._samples, uuids, scope):
+                del self._samples[key]
+
+
+device_counter_store = DeviceCounterStore()
+
+
+def _per_request_ms(times, requests):
+    # cumulative ns spent / requests completed in the interval
+    return round(times / requests / 1000000, 3) if requests else 0.0
+
+
+def get_disk_record(scope, uuid, disk, counters, now):
+    """Counters of one VM disk plus IOPS, throughput and latency per request since the last cycle."""
+    record = {"disk": disk}
+    record.update((key.replace('.', '_'), value) for key, value in counters.items())
+    delta = device_counter_store.delta(scope, uuid, ("disk", disk), counters, now)
+    if delta is not None:
+        elapsed, deltas = delta
+        record.update({
+            "rd_iops": round(deltas["rd.reqs"] / elapsed, 2),
+            "wr_iops": round(deltas["wr.reqs"] / elapsed, 2),
+            "rd_bytes_per_sec": round(deltas["rd.bytes"] / elapsed),
+            "wr_bytes_per_sec": round(deltas["wr.bytes"] / elapsed),
+        })
+        if "fl.reqs" in deltas:
+            record["fl_iops"] = round(deltas["fl.reqs"] / elapsed, 2)
+        # no latency at all without timing counters, a 0.0 would read as an idle disk
+        for op in ("rd", "wr", "fl"):
+            if f"{op}.times" in deltas and f"{op}.reqs" in deltas:
+                record[f"{op}_latency_ms"] = _per_request_ms(deltas[f"{op}.times"], deltas[f"{op}.reqs"])
+    return record
+
+
+def select_block_counters(stats, keys):
+    """BLOCK_COUNTERS read from `stats` under `keys`, in the same order, leaving out unreported optional ones."""
+    return {key: stats.get(stats_key, 0) for key, stats_key in zip(BLOCK_COUNTERS, keys)
+            if stats_key in stats or key not in OPTIONAL_BLOCK_COUNTERS}
+
+
+def get_interface_record(scope, uuid, interface, counters, now):
+    """Counters of one VM interface plus bytes, packets and drops per second since the last cycle."""
+    record = {"interface": interface}
+    record.update((key.replace('.', '_'), value) for key, value in counters.items())
+    delta = device_counter_store.delta(scope, uuid, ("interface", interface), counters, now)
+    if delta is not None:
+        elapsed, deltas = delta
+        for key in ("rx.bytes", "rx.pkts", "rx.drop", "tx.bytes", "tx.pkts", "tx.drop"):
+            record[f"{key.replace('.', '_')}_per_sec"] = round(deltas[key] / elapsed, 2)
+    return record
+
+
+def sum_device_stats(disks, interfaces):
+    """The per-VM io_* and net_* totals over every disk and interface."""
+    io = {
+        'io_read_bytes': sum(disk["rd_bytes"] for disk in disks),
+        'io_write_bytes': sum(disk["wr_bytes"] for disk in disks),
+        'io_read_req': sum(disk["rd_reqs"] for disk in disks),
+        'io_write_req': sum(disk["wr_reqs"] for disk in disks),
+        'io_no_errors': sum(disk["errors"] for disk in disks),
+    }
+    net = {}
+    if interfaces:
+        net.update({
+            'net_read_bytes': sum(interface["rx_bytes"] for interface in interfaces),
+            'net_read_packets': sum(interface["rx_pkts"] for interface in interfaces),
+            'net_read_errors': sum(interface["rx_errs"] for interface in interfaces),
+            'net_read_drops': sum(interface["rx_drop"] for interface in interfaces),
+            'net_write_bytes': sum(interface["tx_bytes"] for interface in interfaces),
+            'net_write_packets': sum(interface["tx_pkts"] for interface in interfaces),
+            'net_write_errors': sum(interface["tx_errs"] for interface in interfaces),
+            'net_write_drops': sum(interface["tx_drop"] for interface in interfaces),
+        })
+    return io, net
+
+
+class VmSample:
+    """
+    Stats of one domain, split into fixed field groups when they are collected.
+
+    Every group is a dict of ready-to-write fields for one measurement, so
+    turning a sample into records is a projection plus the tags, without
+    scanning keys for prefixes. `disks` and `interfaces` hold one record per device.
+    The `disk` group only holds the per-VM disk_* totals of a kvmtop stats log,
+    written to vm_disk without a disk tag as before.
+    """
+    __slots__ = ("name", "uuid", "state", "cpu", "ram", "net", "io", "disk", "disks", "interfaces")
+
+    # group -> (measurement, field prefix in the flat dicts of a kvmtop stats log)
+    GROUPS = {"cpu": ("vm_cpustat", "cpu_"), "ram": ("vm_memory", "ram_"),
+              "net": ("vm_nics", "net_"), "io": ("vm_iostat", "io_"), "disk": ("vm_disk", "disk_")}
+
+    def __init__(self, name, uuid, state):
+        self.name = name
+        self.uuid = uuid
+        self.state = state
+        self.cpu = {}
+        self.ram = {}
+        self.net = {}
+        self.io = {}
+        self.disk = {}
+        self.disks = []
+        self.interfaces = []
+
+    @classmethod
+    def from_dict(cls, data, state=None):
+        """Sample from the flat dict of a domain in a kvmtop stats log."""
+        sample = cls(data.get('name'), data.get('UUID', ""), data.get('state', state))
+        for group, (_, prefix) in cls.GROUPS.items():
+            setattr(sample, group, {key: value for key, value in data.items() if key.startswith(prefix)})
+        return sample
+
+    def merge_missing(self, other):
+        # fields this sample already has take precedence
+        for group in self.GROUPS:
+            merged = dict(getattr(other, group))
+            merged.update(getattr(self, group))
+            setattr(self, group, merged)
+
+    def measurements(self, hostname, host_uuid):
+        """Return {measurement: record or [records]} ready for send_data_to_influxdb."""
+        tags = {"host": hostname, "host_uuid": host_uuid, "vm_name": self.name or "", "vm_id": self.uuid or ""}
+        records = {"vm_cpustat": dict(self.cpu, state=self.state, **tags)}
+        if self.ram:
+            records["vm_memory"] = {key: round(value / (1024 * 1024), 2) for key, value in self.ram.items()}
+            records["vm_memory"].update(tags)
+        if self.net:
+            records["vm_nics"] = dict(self.net, **tags)
+        if self.io:
+            records["vm_iostat"] = dict(self.io, **tags)
+        if self.disks or self.disk:
+            records["vm_disk"] = [dict(disk, **tags) for disk in self.disks]
+            if self.disk:
+                records["vm_disk"].append(dict(self.disk, **tags))
+        if self.interfaces:
+            records["vm_interface"] = [dict(interface, **tags) for interface in self.interfaces]
+        return records
+
+
+def get_ram_used(total, free, buffers, cached):
+    """
+    Host memory in use, in kB. Local and remote hypervisors share this definition:
+    virNodeGetMemoryStats has no MemAvailable, only total, free, buffers and cached.
+    """
+    return total - free - buffers - cached
+
+
+class HostCpuSampler:
+    """
+    Host CPU usage from /proc/stat without sleeping in the collector.
+
+    Every `sample()` compares the counters with the snapshot taken by the
+    previous call (or at import time) and returns the usage over that interval,
+    in total and per core, with the steal, iowait and irq shares split out.
+    """
+
+    BREAKDOWN = ("user", "nice", "system", "iowait", "irq", "softirq", "steal")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._previous = read_proc_stat()
+
+    def sample(self):
+        current = read_proc_stat()
+        with self._lock:
+            previous, self._previous = self._previous, current
+
+        stats = {}
+        for cpu, counters in current.items():
+            last = previous.get(cpu)
+            if last is None:
+                continue
+            # guest time is already accounted in user/nice
+            deltas = {key: counters[key] - last[key] for key in counters if key not in ("guest", "guest_nice")}
+            total = sum(deltas.values())
+            if total <= 0:
+                continue
+            busy = total - deltas["idle"] - deltas["iowait"]
+            if cpu == "cpu":
+                stats["cpu_usage"] = round(busy / total * 100, 2)
+                for key in self.BREAKDOWN:
+                    stats[f"cpu_usage_{key}"] = round(deltas[key] / total * 100, 2)
+            else:
+                stats[f"cpu_core{cpu[3:]}_usage"] = round(busy / total * 100, 2)
+        return stats
+
+
+host_cpu_sampler = HostCpuSampler()
+
+class DomainState:
+    __slots__ = ("name", "state", "since")
+
+    def __init__(self, name, state, since):
+        self.name = name
+        self.state = state
+        self.since = since
+
+
+class DomainStateTable:
+    """
+    State of every domain per hypervisor, kept current by lifecycle events.
+
+    The table is seeded from a full listing on every (re)connect, since events
+    missed while disconnected are lost. From then on every lifecycle event
+    updates it and is written right away as a vm_lifecycle point.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def register(self, uri, conn):
+        now = time.monotonic()
+        try:
+            states = [(dom, record.get("state.state")) for dom, record in
+                      conn.getAllDomainStats(libvirt.VIR_DOMAIN_STATS_STATE, 0)]
+        except (AttributeError, libvirt.libvirtError):
+            # libvirt without getAllDomainStats
+            states = [(dom, dom.state()[0]) for dom in conn.listAllDomains()]
+        table = {dom.UUIDString(): DomainState(dom.name(), VM_STATE_DEFINITION.get(state, "no_state"), now)
+                 for dom, state in states}
+        with self._lock:
+            self._tables[uri] = table
+        conn.domainEventRegisterAny(None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, self._on_lifecycle_event, uri)
+
+    def list(self, uri):
+        """Return [{"name": ..., "state": ...}] for every domain of `uri`."""
+        with self._lock:
+            return [{"name": domain.name, "state": domain.state} for domain in self._tables.get(uri, {}).values()]
+
+    def _on_lifecycle_event(self, conn, dom, event, detail, uri):
+        # runs on the event loop thread
+        try:
+            timestamp, now = time.time_ns(), time.monotonic()
+            name, state = LIFECYCLE_EVENTS.get(event, (str(event), None))
+            name = LIFECYCLE_EVENT_DETAILS.get((event, detail), name)
+            uuid = dom.UUIDString()
+            with self._lock:
+                table = self._tables.setdefault(uri, {})
+                previous = table.get(uuid)
+                if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+                    table.pop(uuid, None)
+                elif previous is None:
+                    table[uuid] = DomainState(dom.name(), state or "shutoff", now)
+                elif state is not None and state != previous.state:
+                    table[uuid] = DomainState(previous.name, state, now)
+
+            record = {
+                "host": get_host_tag(uri),
+                "vm_name": dom.name(),
+                "vm_id": uuid,
+                "event": name,
+                "detail": detail,
+                "state": state or (previous.state if previous else "shutoff"),
+            }
+            if previous is not None:
+                record["previous_state"] = previous.state
+                record["previous_state_seconds"] = round(now - previous.since, 3)
+            write_pipeline.write_record('vm_lifecycle', record, timestamp)
+            logger.info(f"{dom.name()} on {uri}: {name}")
+        except Exception:
+            logger.debug(traceback.format_exc())
+
+
+domain_state_table = DomainStateTable()
+
+# uri -> (hostname, host uuid) as reported by the hypervisor, refreshed on every reconnect
+_hypervisor_identities = {}
+
+if LIBVIRT_AVAILABLE:
+    start_libvirt_event_loop()
+    libvirt_connections = {}
+    for uri in LIBVIRT_URIS:
+        libvirt_connections[uri] = LibvirtConnection(uri)
+        atexit.register(libvirt_connections[uri].close)
+        libvirt_connections[uri].on_connect(lambda conn, uri=uri: domain_topology_cache.register_events(conn, uri))
+        libvirt_connections[uri].on_connect(lambda conn, uri=uri: _hypervisor_identities.pop(uri, None))
+        libvirt_connections[uri].on_connect(lambda conn, uri=uri: domain_state_table.register(uri, conn))
+else:
+    libvirt_connections = {}
+
+# one shared pool for every hypervisor, only used when polling more than one
+_hypervisor_pool = None
+_hypervisor_futures = {}
+
+
+def is_local_uri(uri):
+    """True for the hypervisor this agent runs on, whose host stats come from /proc."""
+    parsed = urlparse(uri)
+    return parsed.scheme.split('+')[0] in ('qemu', 'kvm') and not parsed.hostname
+
+
+def get_hypervisor_identity(uri, conn):
+    identity = _hypervisor_identities.get(uri)
+    if identity is None:
+        host_uuid = ""
+        try:
+            host_uuid = ElementTree.fromstring(conn.getCapabilities()).findtext("host/uuid") or ""
+        except (libvirt.libvirtError, ElementTree.ParseError):
+            logger.debug(traceback.format_exc())
+        identity = _hypervisor_identities[uri] = (get_host_tag(uri), host_uuid)
+    return identity
+
+
+def get_host_tag(uri):
+    """
+    The host tag of a hypervisor: its alias in LIBVIRT_URIS, else the host of
+    its uri, or the whole uri when it has none. What the hypervisor reports as
+    its hostname isn't unique, e.g. for every test:/// uri.
+    """
+    if uri in LIBVIRT_HOST_ALIASES:
+        return LIBVIRT_HOST_ALIASES[uri]
+    if is_local_uri(uri):
+        return socket.gethostname()
+    return urlparse(uri).hostname or uri
+
+
+def get_vms_with_state(uri):
+    # kept current by lifecycle events, no need to ask libvirt (or fork virsh) every cycle
+    return domain_state_table.list(uri)
+
+class HostStatsCollector:
+    """
+    Host stats read straight from /proc, in the shape kvmtop's json printer used
+    to produce: {"host": {"host_name": ..., "host_uuid": ..., "cpu_...": ...}, "domains": []}.
+
+    Disk and network counters are summed over physical devices and turned into
+    per second rates against the previous call.
+    """
+
+    MEMINFO_KEYS = {"MemFree": "ram_free", "MemAvailable": "ram_available", "Buffers": "ram_buffers",
+                    "Cached": "ram_cached", "SwapTotal": "ram_swap_total", "SwapFree": "ram_swap_free"}
+    # virtual or stacked block devices whose io is already counted on the underlying disks
+    VIRTUAL_DISK_PREFIXES = ("loop", "ram", "zram", "dm-", "md", "sr", "nbd")
+
+    def __init__(self):
+        self.host_name = socket.gethostname()
+        self.host_uuid = self._read_host_uuid()
+        self._lock = threading.Lock()
+        self._previous = None
+
+    @staticmethod
+    def _read_host_uuid():
+        for path in ('/sys/class/dmi/id/product_uuid', '/etc/machine-id'):
+            try:
+                with open(path, 'r') as f:
+                    return f.read().strip()
+            except OSError:
+                continue
+        return ""
+
+    def _disk_counters(self):
+        totals = dict.fromkeys(("reads", "writes", "sectors_read", "sectors_written", "io_ms"), 0)
+        for name, counters in read_diskstats().items():
+            # partitions don't show up in /sys/block
+            if name.startswith(self.VIRTUAL_DISK_PREFIXES) or not os.path.exists(f'/sys/block/{name}'):
+                continue
+            for key in totals:
+                totals[key] += counters[key]
+        return totals
+
+    def _net_counters(self):
+        totals = dict.fromkeys(("rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+                                "rx_errs", "tx_errs", "rx_drop", "tx_drop"), 0)
+        for iface, counters in read_net_dev_cached()[1].items():
+            # only physical nics, bridges/taps/vnets would count the same traffic twice
+            if not os.path.exists(f'/sys/class/net/{iface}/device'):
+                continue
+            for key in totals:
+                totals[key] += counters[key]
+        return totals
+
+    def collect(self):
+        now = time.monotonic()
+        disk, net = self._disk_counters(), self._net_counters()
+        with self._lock:
+            previous, self._previous = self._previous, (now, disk, net)
+
+        stats = {
+            "host_name": self.host_name,
+            "host_uuid": self.host_uuid,
+            "cpu_cores": len(read_proc_stat()) - 1,
+        }
+
+        meminfo = read_meminfo()
+        for key, name in self.MEMINFO_KEYS.items():
+            if key in meminfo:
+                stats[name] = meminfo[key]
+        stats["ram_used"] = get_ram_used(meminfo["MemTotal"], meminfo["MemFree"],
+                                         meminfo.get("Buffers", 0), meminfo.get("Cached", 0))
+
+        stats.update({
+            "disk_reads": disk["reads"],
+            "disk_writes": disk["writes"],
+            "disk_read_bytes": disk["sectors_read"] * 512,
+            "disk_write_bytes": disk["sectors_written"] * 512,
+        })
+        stats.update({f"net_{key}": value for key, value in net.items()})
+
+        if previous is not None and now > previous[0]:
+            elapsed = now - previous[0]
+            last_disk, last_net = previous[1], previous[2]
+            stats.update({
+                "disk_read_iops": round((disk["reads"] - last_disk["reads"]) / elapsed, 2),
+                "disk_write_iops": round((disk["writes"] - last_disk["writes"]) / elapsed, 2),
+                "disk_read_rate": round((disk["sectors_read"] - last_disk["sectors_read"]) * 512 / elapsed),
+                "disk_write_rate": round((disk["sectors_written"] - last_disk["sectors_written"]) * 512 / elapsed),
+                "net_rx_rate": round((net["rx_bytes"] - last_net["rx_bytes"]) / elapsed),
+                "net_tx_rate": round((net["tx_bytes"] - last_net["tx_bytes"]) / elapsed),
+            })
+
+        for resource in ("cpu", "memory", "io"):
+            try:
+                pressure = read_pressure(resource)
+            except OSError:
+                # kernel without CONFIG_PSI
+                continue
+            for kind, values in pressure.items():
+                for key, value in values.items():
+                    stats[f"psi_{resource}_{kind}_{key}"] = value
+
+        return {"host": stats, "domains": []}
+
+
+host_stats_collector = HostStatsCollector()
 
-def get_vms_with_state():
-    try:
-        output_lines = subprocess.check_output(['virsh', 'list', '--all']).decode('utf-8').strip().split('\n')
-        vm_stats = []
-        keys = output_lines[0].split('   ')
-        keys = [key.lower().strip() for key in keys]
-        for line in output_lines[2:]:
-            values = line.split('   ')
-            vm_stat = dict()
-            vm_stat[keys[0]] = values[0].strip()
-            vm_stat[keys[1]] = values[1].strip()
-            vm_stat[keys[2]] = values[2].strip()
-            vm_stats.append(vm_stat)
-        return vm_stats
-    except Exception as e:
-        logger.debug(traceback.format_exc())
-        return []
 
 def get_kvm_stats():
     try:
-        output = subprocess.check_output(
-            ['sudo', 'kvmtop', '--cpu', '--mem', '--disk', '--net', '--io', '--host',
-             '--printer=json', '--runs=1'], text=True)
-        if output and output.startswith('{ "'):
-            data = ujson.loads(output)
-            return data
+        return host_stats_collector.collect()
     except Exception as e:
         logger.debug(traceback.format_exc())
     return {}
 
-def sync_data_to_influx_db(data):
+
+def sync_data_to_influx_db(data, timestamp=None):
     try:
-        point = create_influxdb_point('kvm_stats', data)
-        write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point)
-        logger.debug(f"writing record for kvm_stats finished.")
+        write_pipeline.write_record('kvm_stats', data, timestamp)
+        logger.debug(f"queued record for kvm_stats.")
     except Exception as e:
         logger.debug(traceback.format_exc())
         return
@@ -82,7 +857,7 @@ def group_data_points(key_prefix, source_data):
     return {key: source_data[key] for key in source_data if key.startswith(key_prefix)}
 
 
-def filter_and_group_host_stats(hostname, host_uuid, data):
+def filter_and_group_host_stats(hostname, host_uuid, data, local=True):
     try:
         to_return = {}
         host_key_groups = {"cpu_": "cpustat", "ram_": "memory", "disk_": "disk", "net_": "nics", "psi_": "psistat"}
@@ -92,8 +867,8 @@ def filter_and_group_host_stats(hostname, host_uuid, data):
                 if host_key_groups[key] == "memory":
                     for k, v in data_group.items():
                         data_group[k] = round(v / (1024*1024), 2)
-                if host_key_groups[key] == "cpustat":
-                    data_group['cpu_usage'] = psutil.cpu_percent(interval=MONITORING_INTERVAL)
+                if host_key_groups[key] == "cpustat" and local:
+                    data_group.update(host_cpu_sampler.sample())
                 data_group.update({"host": hostname, "host_uuid": host_uuid})
                 to_return[host_key_groups[key]] = data_group
         return to_return
@@ -102,248 +877,319 @@ def filter_and_group_host_stats(hostname, host_uuid, data):
         return {}
 
 
-def filter_and_group_vm_stats(hostname, host_uuid, data):
+def send_data_to_influxdb(data, timestamp=None):
+    aggregator = get_aggregator('kvm_monitor')
+    suppressor = get_suppressor('kvm_monitor')
+    for key, values in data.items():
+        # per-device measurements carry a list of records
+        for value in (values if isinstance(values, list) else [values]):
+            if aggregator is not None and value:
+                value = aggregator.add(key, value)
+            if suppressor is not None and value:
+                value = suppressor.filter(key, value)
+            if value:
+                write_pipeline.write_record(key, value, timestamp)
+                logger.debug(f"queued record for {key}.")
+    else:
+        logger.debug('Queued all data points from kvm_monitor')
+
+
+def send_data(log, uri):
     try:
-        to_return = {}
-        vm_name = data.get('name', "")
-        vm_id = data.get('UUID', "")
-        host_key_groups = {"cpu_": "cpustat", "ram_": "memory", "disk_": "disk", "net_": "nics", "io_": "iostat", }
-        for key in host_key_groups.keys():
-            data_group = group_data_points(key_prefix=key, source_data=data)
-            if key == 'cpu_':
-                data_group.update({'state': data.get('state')})
-            if host_key_groups[key] == "memory":
-                for k, v in data_group.items():
-                    data_group[k] = round(v / (1024 * 1024), 2)
-            if data_group:
-                data_group.update({"host": hostname, "host_uuid": host_uuid, "vm_name": vm_name, "vm_id": vm_id})
-                to_return[f"vm_{host_key_groups[key]}"] = data_group
-        return to_return
+        timestamp = time.time_ns()
+        hostname = log.get("host", {}).get("host_name")
+        host_uuid = log.get("host", {}).get("host_uuid")
+        host, vms = get_vms_and_host_stats(uri)
+        if not is_local_uri(uri):
+            # a remote hypervisor is tagged after its uri, see get_host_tag
+            hostname, host_uuid = host.pop("host_name"), host.pop("host_uuid")
+        elif uri in LIBVIRT_HOST_ALIASES:
+            hostname = get_host_tag(uri)
+        log['host'].update(host)
+        host_data = filter_and_group_host_stats(hostname, host_uuid, data=log.get('host'), local=is_local_uri(uri))
+        send_data_to_influxdb(host_data, timestamp)
+
+        samples = {sample.name: sample for sample in vms}
+        domains = log.get('domains', [])
+        if domains:
+            # domains of a kvmtop stats log, what libvirt reported takes precedence
+            for domain in domains:
+                legacy = VmSample.from_dict(domain, state='running')
+                if legacy.name in samples:
+                    samples[legacy.name].merge_missing(legacy)
+                else:
+                    samples[legacy.name] = legacy
+        else:
+            for vm in get_vms_with_state(uri):
+                if vm["name"] not in samples:
+                    samples[vm["name"]] = VmSample(vm["name"], "", vm["state"])
+
+        for sample in samples.values():
+            if sample.state == 'running':
+                send_data_to_influxdb(sample.measurements(hostname, host_uuid), timestamp)
+        return True
     except Exception as e:
         logger.debug(traceback.format_exc())
-        return {}
+        return
 
 
-def send_data_to_influxdb(data):
-    for key, value in data.items():
-        if value:
-            point = create_influxdb_point(key, value)
-            write_api.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point)
-            logger.debug(f"writing record for {key} finished.")
-    else:
-        logger.debug('Uploaded all data points from kvm_monitor')
+def send_log_lines(lines, uri):
+    import ujson
 
+    # every line is a full json snapshot, only the newest one of a burst is still current
+    for line in reversed(lines):
+        try:
+            log = ujson.loads(line)
+        except ValueError:
+            logger.debug(f"Skipping malformed kvm stats line: {line[:100]}")
+            continue
+        send_data(log, uri)
+        return
 
-def merge_lists_of_dicts(list1, list2, key):
-    # Create a dictionary to hold merged results
-    merged_dict = {}
 
-    # Add dictionaries from the first list to the merged_dict
-    for item in list1:
-        merged_dict[item[key]] = item
+def collect_data_continuously(log_file=KVM_STATS_LOG):
+    if not log_file:
+        logger.debug("KVM_STATS_LOG is not set, no kvm stats log to follow")
+        return
+    # kvmtop runs next to the agent, its stats belong to the local hypervisor
+    uri = next((uri for uri in LIBVIRT_URIS if is_local_uri(uri)), None)
+    if uri is None:
+        logger.warning(f"Not following {log_file}, LIBVIRT_URIS has no local hypervisor")
+        return
+    # the tailer needs inotify, which the polling collector doesn't
+    from modules.tailer import LogTailer
+    LogTailer(log_file, lambda lines: send_log_lines(lines, uri)).run()
 
-    # Update the merged_dict with dictionaries from the second list
-    for item in list2:
-        if item[key] in merged_dict:
-            # If the key exists, merge the dictionaries
-            merged_dict[item[key]].update(item)
-        else:
-            # If the key does not exist, add the new item
-            merged_dict[item[key]] = item
 
-    # Convert merged_dict back to a list
-    return list(merged_dict.values())
+def get_cpu_usage_percentage(vm, scope):
+    cpu_stats = vm.getCPUStats(True)[0]
+    user_time = cpu_stats['user_time'] / 1000000000  # Convert from nanoseconds to seconds
+    system_time = cpu_stats['system_time'] / 1000000000
+    total_cpu_time = user_time + system_time
 
+    # Per virtual CPU (number, state, cpu time, physical cpu)
+    v_cpus = vm.vcpus()[0]
+    vcpu_times = [v_cpu[2] / 1000000000 for v_cpu in v_cpus]
 
-def send_data(log):
-    try:
-        vms_list = get_vms_with_state()
-        domains = log.get('domains', [])
-        if not domains:
-            for vm in vms_list:
-                vm_stat = dict()
-                vm_stat['name'] = vm.get('name')
-                vm_stat['state'] = vm.get('state')
-                domains.append(vm_stat)
-        else:
-            for domain in domains:
-                domain.update({'state': 'running'})
+    return cpu_sample_store.update(scope, vm.UUIDString(), total_cpu_time, vcpu_times)
 
-        hostname = log.get("host", {}).get("host_name")
-        host_uuid = log.get("host", {}).get("host_uuid")
-        host, vms = get_vms_and_host_stats()
-        log['host'].update(host)
-        host_data = filter_and_group_host_stats(hostname, host_uuid, data=log.get('host'))
-        send_data_to_influxdb(host_data)
-        combined_vms = merge_lists_of_dicts(domains, vms, 'name')
-        for vm_stats in combined_vms:
-            if vm_stats.get('state') == 'running':
-                send_data_to_influxdb(filter_and_group_vm_stats(hostname, host_uuid, data=vm_stats))
-        return True
-    except Exception as e:
-        logger.debug(traceback.format_exc())
-        return
 
+def get_remote_host_memory(conn):
+    # same keys and kB units as the /proc/meminfo based host stats
+    memory = conn.getMemoryStats(libvirt.VIR_NODE_MEMORY_STATS_ALL_CELLS)
+    stats = {f"ram_{key}": memory[key] for key in ("free", "buffers", "cached") if key in memory}
+    if "total" in memory and "free" in memory:
+        stats["ram_used"] = get_ram_used(memory["total"], memory["free"],
+                                         memory.get("buffers", 0), memory.get("cached", 0))
+    return stats
 
-def collect_data_continuously():
-    log_file = "/home/vignesh/dev/kvmtop.logs"
-    i = inotify.adapters.Inotify()
-    i.add_watch(log_file)
 
-    try:
-        for event in i.event_gen(yield_nones=False):
-            (_, type_names, path, filename) = event
+def get_host_information(conn):
+    stats = conn.getInfo()
+    return {
+        "cpu_model": stats[0],
+        "ram_total": stats[1]/1024,
+        "cpu_cores": stats[2],
+        "cpu_max_freq": stats[3],
+        "cpu_numa_nodes": stats[4],
+        "cpu_sockets_per_node": stats[5],
+        "cpu_cores_per_socket": stats[6],
+        "cpu_max_threads_per_core": stats[7]
+    }
 
-            if "IN_MODIFY" in type_names:
-                with open(log_file, 'r') as file:
-                    lines = file.readlines()
-                    last_line = lines[-1].strip()
-                    t1 = Thread(target=send_data, args=(last_line,))
-                    t1.run()
 
-    finally:
-        i.remove_watch(log_file)
+# getAllDomainStats needs libvirt >= 1.2.8, in the python binding and in every libvirtd polled
+BULK_STATS_SUPPORTED = LIBVIRT_AVAILABLE and hasattr(libvirt.virConnect, 'getAllDomainStats')
+# scopes whose libvirtd answered getAllDomainStats with VIR_ERR_NO_SUPPORT
+_bulk_stats_unsupported = set()
 
+# balloon.* stats -> the ram_ fields the memoryStats() keys of the per-VM path produce
+BULK_BALLOON_FIELDS = (
+    ("balloon.current", "ram_actual"), ("balloon.swap_in", "ram_swap_in"), ("balloon.swap_out", "ram_swap_out"),
+    ("balloon.major_fault", "ram_major_fault"), ("balloon.minor_fault", "ram_minor_fault"),
+    ("balloon.unused", "ram_unused"), ("balloon.available", "ram_available"), ("balloon.usable", "ram_usable"),
+    ("balloon.rss", "ram_rss"), ("balloon.last-update", "ram_last_update"), ("balloon.disk_caches", "ram_disk_caches"),
+    ("balloon.hugetlb_pgalloc", "ram_hugetlb_pgalloc"), ("balloon.hugetlb_pgfail", "ram_hugetlb_pgfail"),
+)
 
-def get_vm_last_known_cpu_time(vm_name):
-    try:
-        with open(f'./{vm_name}.dat', 'r') as f:
-            time_and_cpu_time = f.read()
-            if time_and_cpu_time:
-                timestamp, cpu_time = [float(data) for data in time_and_cpu_time.split(',')]
-                return timestamp, cpu_time
-            return time.time(), 0.0
-    except FileNotFoundError:
-        return time.time(), 0.0
 
+def get_vm_stats_bulk(conn, scope):
+    """Collect stats of all domains with a single getAllDomainStats RPC."""
+    stats_mask = (libvirt.VIR_DOMAIN_STATS_STATE | libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+                  libvirt.VIR_DOMAIN_STATS_BALLOON | libvirt.VIR_DOMAIN_STATS_VCPU |
+                  libvirt.VIR_DOMAIN_STATS_INTERFACE | libvirt.VIR_DOMAIN_STATS_BLOCK)
+    vm_stats = []
+    for vm, record in conn.getAllDomainStats(stats_mask, 0):
+        state = record.get("state.state")
+        sample = VmSample(vm.name(), vm.UUIDString(), VM_STATE_DEFINITION.get(state))
+        sample.cpu = {
+            "cpu_cores": record.get("vcpu.current", 0),
+            "cpu_time": record.get("cpu.time", 0) / 1000000000,
+        }
+        sample.ram = {
+            "ram_max": record.get("balloon.maximum", 0),
+            "ram_actual": record.get("balloon.current", 0),
+        }
+        if state == libvirt.VIR_DOMAIN_RUNNING:
+            total_cpu_time = (record.get("cpu.user", 0) + record.get("cpu.system", 0)) / 1000000000
+            vcpu_times = [record.get(f"vcpu.{i}.time", 0) / 1000000000 for i in range(record.get("vcpu.current", 0))]
+            cpu_usage, vcpu_usage = cpu_sample_store.update(scope, sample.uuid, total_cpu_time, vcpu_times)
+            sample.cpu["cpu_usage"] = cpu_usage
+            for i, usage in enumerate(vcpu_usage):
+                sample.cpu[f"cpu_vcpu{i}_usage"] = usage
+            for key, field in BULK_BALLOON_FIELDS:
+                value = record.get(key)
+                if value is not None:
+                    sample.ram[field] = value
 
-def set_vm_last_known_cpu_time(vm_name, cpu_time, timestamp):
-    try:
-        with open(f'./{vm_name}.dat', 'w') as f:
-            return f.write(f"{timestamp}, {cpu_time}")
-    except FileNotFoundError:
-        return 0
+            now = time.monotonic()
+            sample.disks = [get_disk_record(scope, sample.uuid, record.get(f"block.{i}.name", str(i)),
+                                            select_block_counters(record, [f"block.{i}.{key}" for key in BLOCK_COUNTERS]),
+                                            now)
+                            for i in range(record.get("block.count", 0))]
+            sample.interfaces = [get_interface_record(scope, sample.uuid, record.get(f"net.{i}.name", str(i)),
+                                                      {key: record.get(f"net.{i}.{key}", 0) for key in NET_COUNTERS},
+                                                      now)
+                                 for i in range(record.get("net.count", 0))]
+            sample.io, sample.net = sum_device_stats(sample.disks, sample.interfaces)
 
+        vm_stats.append(sample)
+    uuids = [sample.uuid for sample in vm_stats]
+    cpu_sample_store.prune(uuids, scope)
+    device_counter_store.prune(uuids, scope)
+    return vm_stats
 
-def get_cpu_usage_percentage(vm):
-    last_timestamp, prev_cpu_time = get_vm_last_known_cpu_time(vm.name())
-    cpu_stats = vm.getCPUStats(True)[0]
-    user_time = cpu_stats['user_time'] / 1000000000  # Convert from nanoseconds to seconds
-    system_time = cpu_stats['system_time'] / 1000000000
-    total_cpu_time = user_time + system_time
 
-    # Calculate the CPU time used since the last measurement
-    cpu_time_used = total_cpu_time - prev_cpu_time
+def get_block_counters(vm, disk):
+    try:
+        # includes the total read/write/flush times
+        flags_stats = vm.blockStatsFlags(disk)
+        return select_block_counters(flags_stats, BLOCK_STATS_FLAGS_KEYS)
+    except (AttributeError, libvirt.libvirtError) as e:
+        # old bindings lack the method, old daemons reject the call
+        if isinstance(e, libvirt.libvirtError) and e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+            raise
+        # no timing or flush counters here, so no latency either
+        (rd_req, rd_bytes, wr_req, wr_bytes, err) = vm.blockStats(disk)
+        return {"rd.reqs": rd_req, "rd.bytes": rd_bytes, "wr.reqs": wr_req, "wr.bytes": wr_bytes, "errors": err}
 
-    # Get the number of virtual CPUs
-    v_cpus = vm.vcpus()[0]
-    no_v_cpus = len(v_cpus)
 
-    # Calculate CPU usage percentage
-    current_time = time.time()
-    duration = round(current_time - last_timestamp)
-    if duration and no_v_cpus:
-        cpu_usage_percentage = (cpu_time_used / (duration * no_v_cpus)) * 100  # 1 second interval
-    else:
-        cpu_usage_percentage = 0.0
+def get_vm_stats_per_domain(conn, scope):
+    """Fallback for libvirt versions without getAllDomainStats, several RPCs per domain."""
+    vms = conn.listAllDomains()
+    vm_stats = []
+    if vms:
+        for vm in vms:
+            state, max_mem, mem, no_of_cpu, cpu_time = vm.info()
+            sample = VmSample(vm.name(), vm.UUIDString(), VM_STATE_DEFINITION.get(state))
+            sample.cpu = {
+                "cpu_cores": no_of_cpu,
+                "cpu_time": cpu_time / 1000000000,
+            }
+            sample.ram = {
+                "ram_max": max_mem,
+                "ram_actual": mem,
+            }
+            if state == libvirt.VIR_DOMAIN_RUNNING:
+                cpu_usage, vcpu_usage = get_cpu_usage_percentage(vm, scope)
+                sample.cpu["cpu_usage"] = cpu_usage
+                for i, usage in enumerate(vcpu_usage):
+                    sample.cpu[f"cpu_vcpu{i}_usage"] = usage
+                for key, value in vm.memoryStats().items():
+                    sample.ram[f"ram_{key}"] = value
 
-    set_vm_last_known_cpu_time(vm.name(), total_cpu_time, current_time)
+                topology = domain_topology_cache.get(vm, scope)
+                now = time.monotonic()
+                sample.disks = [get_disk_record(scope, sample.uuid, disk, get_block_counters(vm, disk), now)
+                                for disk in topology.disks]
+                sample.interfaces = [get_interface_record(scope, sample.uuid, interface,
+                                                          dict(zip(NET_COUNTERS, vm.interfaceStats(interface))), now)
+                                     for interface in topology.interfaces if interface]
+                sample.io, sample.net = sum_device_stats(sample.disks, sample.interfaces)
 
-    return cpu_usage_percentage
+            vm_stats.append(sample)
+        uuids = [vm.UUIDString() for vm in vms]
+        domain_topology_cache.prune(uuids, scope)
+        cpu_sample_store.prune(uuids, scope)
+        device_counter_store.prune(uuids, scope)
+    return vm_stats
 
 
-def get_vms_and_host_stats():
-    conn = libvirt.open("qemu:///system")
-    try:
-        stats = conn.getInfo()
-        host_information = {
-            "cpu_model": stats[0],
-            "ram_total": stats[1]/1024,
-            "cpu_cores": stats[2],
-            "cpu_max_freq": stats[3],
-            "cpu_numa_nodes": stats[4],
-            "cpu_sockets_per_node": stats[5],
-            "cpu_cores_per_socket": stats[6],
-            "cpu_max_threads_per_core": stats[7]
-        }
-        vms = conn.listAllDomains()
-        vm_stats = []
-        if vms:
-            for vm in vms:
-                state, max_mem, mem, no_of_cpu, cpu_time = vm.info()
-                stats = {
-                    "cpu_cores": no_of_cpu,
-                    "cpu_time": cpu_time / 1000000000,
-                    "state": VM_STATE_DEFINITION.get(state),
-                    "name": vm.name(),
-                    "ram_max": max_mem,
-                    "ram_actual": mem,
-                }
-                if state == libvirt.VIR_DOMAIN_RUNNING:
-                    cpu_usage_percentage = get_cpu_usage_percentage(vm)
-                    stats["cpu_usage"] = cpu_usage_percentage
-                    mem_stat = vm.memoryStats()
-                    for key, value in mem_stat.items():
-                        stats.update({
-                            f"ram_{key}": value
-                        })
-
-                    tree = ElementTree.fromstring(vm.XMLDesc())
-                    disks = [path.get('file', '') for path in tree.findall("devices/disk/source")]
-                    total_read_bytes, total_write_bytes = 0, 0
-                    total_read_req, total_write_req, total_no_errors = 0, 0, 0
-                    for disk in disks:
-                        (rd_req, rd_bytes, wr_req, wr_bytes, err) = vm.blockStats(disk)
-                        # stats.update({
-                        #     "disk_id": disk,
-                        #     'disk_no_read_req': rd_req,
-                        #     'disk_read_bytes': rd_bytes,
-                        #     'disk_no_write_req': wr_req,
-                        #     'disk_write_bytes': wr_bytes,
-                        #     'disk_no_errors': err,
-                        # })
-                        total_read_bytes += rd_bytes
-                        total_write_bytes += wr_bytes
-                        total_read_req += rd_req
-                        total_write_req += wr_req
-                        total_no_errors += total_no_errors
-                    stats.update({
-                        'io_read_bytes': total_read_bytes,
-                        'io_write_bytes': total_write_bytes,
-                        'io_read_req': total_read_req,
-                        'io_write_req': total_write_req,
-                        'io_no_errors': total_no_errors,
-                    })
-
-                    interface = tree.find("devices/interface/target").get("dev")
-                    net_stats = vm.interfaceStats(interface)
-                    stats.update({
-                        'net_read_bytes': net_stats[0],
-                        'net_read_packets': net_stats[1],
-                        'net_read_errors': net_stats[2],
-                        'net_read_drops': net_stats[3],
-                        'net_write_bytes': net_stats[4],
-                        'net_write_packets': net_stats[5],
-                        'net_write_errors': net_stats[6],
-                        'net_write_drops': net_stats[7],
-                    })
-
-                vm_stats.append(stats)
+def get_vm_stats(conn, scope):
+    """`scope` names the hypervisor, the caches keep the domains of every hypervisor apart."""
+    if BULK_STATS_SUPPORTED and hasattr(conn, 'getAllDomainStats') and scope not in _bulk_stats_unsupported:
+        try:
+            return get_vm_stats_bulk(conn, scope)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+                raise
+            _bulk_stats_unsupported.add(scope)
+            logger.warning(f"getAllDomainStats not supported by {scope}, falling back to per-domain stats")
+    return get_vm_stats_per_domain(conn, scope)
 
+
+def get_vms_and_host_stats(uri):
+    conn = libvirt_connections[uri].get()
+    try:
+        host_information = get_host_information(conn)
+        if not is_local_uri(uri):
+            host_information.update(get_remote_host_memory(conn))
+            host_information["host_name"], host_information["host_uuid"] = get_hypervisor_identity(uri, conn)
+        vm_stats = get_vm_stats(conn, scope=uri)
         return host_information, vm_stats
 
     except Exception as e:
         logger.debug(traceback.format_exc())
-    finally:
-        conn.close()
 
 
+def collect_hypervisor(uri):
+    try:
+        # only the local hypervisor has host stats in /proc, remote ones report theirs through libvirt
+        data = get_kvm_stats() if is_local_uri(uri) else {"host": {}, "domains": []}
+        return send_data(data, uri)
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+    return False
+
+
+def collect_hypervisors():
+    """Poll every hypervisor on the shared pool, a slow or unreachable one doesn't hold up the rest."""
+    global _hypervisor_pool
+    if _hypervisor_pool is None:
+        _hypervisor_pool = ThreadPoolExecutor(max_workers=min(LIBVIRT_POLL_WORKERS, len(LIBVIRT_URIS)),
+                                              thread_name_prefix="hypervisor")
+    futures = []
+    for uri in LIBVIRT_URIS:
+        previous = _hypervisor_futures.get(uri)
+        if previous is not None and not previous.done():
+            logger.warning(f"Skipping {uri}, previous poll still in progress")
+            continue
+        _hypervisor_futures[uri] = _hypervisor_pool.submit(self_metrics.wrap(collect_hypervisor), uri)
+        futures.append(_hypervisor_futures[uri])
+
+    done, not_done = wait(futures, timeout=LIBVIRT_POLL_TIMEOUT)
+    if not_done:
+        logger.warning(f"{len(not_done)} of {len(futures)} hypervisors didn't answer within {LIBVIRT_POLL_TIMEOUT}s")
+    return any(future.result() for future in done)
+
+
+def probe():
+    """
+    Only static checks: libvirtd may come up after the agent or restart at any
+    time, LibvirtConnection reconnects with backoff while collecting.
+    """
+    if not LIBVIRT_AVAILABLE:
+        return "libvirt python module failed to import"
+    if not LIBVIRT_URIS:
+        return "LIBVIRT_URIS is empty"
+    return None
 
 
 def collect_data():
     try:
-        data = get_kvm_stats()
-        return send_data(data)
+        if len(LIBVIRT_URIS) == 1:
+            return collect_hypervisor(LIBVIRT_URIS[0])
+        return collect_hypervisors()
     except Exception as e:
         logger.debug(traceback.format_exc())
     return False
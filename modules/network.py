@@ -1,32 +1,123 @@
-import socket
+import os
+import re
+import glob
 import time
+import socket
+import fnmatch
 import traceback
+from xml.etree import ElementTree
+
+from line_protocol import register_measurement
+from modules import get_module_settings, logger
+from modules.procfs import read_net_dev
+
+REQUIREMENTS = {"paths": ("/proc/net/dev",)}
+
+# one record per interface
+register_measurement('network', ("host", "iface", "vm_name", "vm_id"))
+
+LIBVIRT_STATUS_DIR = '/run/libvirt/qemu'
+# proxmox names the taps of a VM tap<vmid>i<n>
+PVE_TAP = re.compile(r'^tap(\d+)i\d+$')
+
+settings = get_module_settings('network')
+INCLUDE = settings.get("include", ["*"])
+EXCLUDE = settings.get("exclude", ["lo"])
+MAP_VM_TAPS = settings.get("map_vm_taps", False)
+
+last_counters, last_captured_time = None, None
+_tap_owners, _tap_owners_key = {}, None
+
+
+def is_selected(iface):
+    return (any(fnmatch.fnmatchcase(iface, pattern) for pattern in INCLUDE) and
+            not any(fnmatch.fnmatchcase(iface, pattern) for pattern in EXCLUDE))
+
 
-import psutil
+def get_tap_owners():
+    """Map tap/vnet devices to the VM owning them, from libvirt's live domain status files."""
+    global _tap_owners, _tap_owners_key
+    paths = glob.glob(os.path.join(LIBVIRT_STATUS_DIR, '*.xml'))
+    key = tuple(sorted((path, os.path.getmtime(path)) for path in paths))
+    # only re-parse when a domain was started, stopped or changed
+    if key == _tap_owners_key:
+        return _tap_owners
 
-from modules import logger
+    owners = {}
+    for path in paths:
+        try:
+            domain = ElementTree.parse(path).getroot().find('domain')
+            if domain is None:
+                continue
+            vm_name = domain.findtext('name')
+            for target in domain.findall('devices/interface/target'):
+                owners[target.get('dev')] = {"vm_name": vm_name}
+        except (OSError, ElementTree.ParseError):
+            logger.debug(traceback.format_exc())
+    _tap_owners, _tap_owners_key = owners, key
+    return owners
+
+
+def get_owner(iface, owners):
+    if iface in owners:
+        return owners[iface]
+    match = PVE_TAP.match(iface)
+    if match:
+        return {"vm_id": match.group(1)}
+    return {}
+
+
+def counter_delta(current, previous):
+    # counters restart from 0 when a device is re-created or the counter wraps
+    return current - previous if current >= previous else current
+
+
+def read_counters():
+    # not read_net_dev_cached(), at a 1s sample interval two samples could get the same snapshot
+    return time.monotonic(), read_net_dev()
 
-io, last_captured_time = psutil.net_io_counters(pernic=True), time.time()
 
 def collect_data():
     try:
-        global io, last_captured_time
-        io_2, recent_captured_time = psutil.net_io_counters(pernic=True), time.time()
-        delay = recent_captured_time - last_captured_time
-        data = {}
-        for iface, iface_io in io.items():
-            bytes_sent_iface = io_2[iface].bytes_sent if io_2.get(iface) else 0
-            bytes_recv_iface = io_2[iface].bytes_recv if io_2.get(iface) else 0
-            upload_speed, download_speed = bytes_sent_iface - iface_io.bytes_sent, bytes_recv_iface - iface_io.bytes_recv
-            data.update({
-                f"{iface}_download": bytes_recv_iface,
-                f"{iface}_upload": bytes_sent_iface,
-                f"{iface}_upload_speed": round(upload_speed / delay) ,
-                f"{iface}_download_speed": round(download_speed / delay),
-            })
-        io, last_captured_time = io_2, recent_captured_time
-        data.update({"host": socket.gethostname()})
+        global last_counters, last_captured_time
+        captured_time, counters = read_counters()
+        hostname = socket.gethostname()
+        owners = get_tap_owners() if MAP_VM_TAPS else {}
+
+        data = []
+        for iface, iface_io in counters.items():
+            if not is_selected(iface):
+                continue
+            record = {
+                "host": hostname,
+                "iface": iface,
+                "download": iface_io["rx_bytes"],
+                "upload": iface_io["tx_bytes"],
+                "download_packets": iface_io["rx_packets"],
+                "upload_packets": iface_io["tx_packets"],
+                "download_errors": iface_io["rx_errs"],
+                "upload_errors": iface_io["tx_errs"],
+                "download_drops": iface_io["rx_drop"],
+                "upload_drops": iface_io["tx_drop"],
+            }
+            if MAP_VM_TAPS:
+                record.update(get_owner(iface, owners))
+
+            previous = last_counters.get(iface) if last_counters else None
+            delay = captured_time - last_captured_time if last_captured_time else 0
+            if previous is not None and delay > 0:
+                record.update({
+                    "upload_speed": round(counter_delta(iface_io["tx_bytes"], previous["tx_bytes"]) / delay),
+                    "download_speed": round(counter_delta(iface_io["rx_bytes"], previous["rx_bytes"]) / delay),
+                })
+            data.append(record)
+
+        last_counters, last_captured_time = counters, captured_time
         return data
     except Exception:
         logger.debug(f"Failed to capture network stats {traceback.format_exc()}")
-        return {}
\ No newline at end of file
+        return {}
+
+
+# prime the counters so the first collection already has speeds
+last_captured_time, last_counters = read_counters()
@@ -1,62 +1,127 @@
-import subprocess, re, json
+import re
+import socket
+import threading
+import time
+
+from line_protocol import register_measurement
 from modules import logger
 
-# Define a function to parse the data
-def parse_nfsiostat(data):
-    # Extract the NFS server information
-    server_info = re.search(r"(\S+):(/[^ ]+)\s+mounted on\s+([^\n]+)", data)
-    server_address, nfs_mount, mount_point = server_info.groups() if server_info else (None, None, None)
-
-    # Extract the ops/s and rpc bklog
-    ops_rpc_bklog = re.search(r"ops/s\s+rpc bklog\n\s+([0-9.]+)\s+([0-9.]+)", data)
-    ops_per_sec, rpc_bklog = ops_rpc_bklog.groups() if ops_rpc_bklog else (None, None)
-
-    # Extract read data
-    read_data = re.search(r"read:\s+ops/s\s+kB/s\s+kB/op\s+retrans\s+avg RTT \(ms\)\s+avg exe \(ms\)\s+avg queue \(ms\)\s+errors\n\s+([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9]+)\s+\([0-9.]+\%\)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9]+)", data)
-    read_ops_per_sec, read_kb_per_sec, read_kb_per_op, read_retrans, read_avg_rtt, read_avg_exe, read_avg_queue, read_errors = read_data.groups() if read_data else (None, None, None, None, None, None, None, None)
-
-    # Extract write data
-    write_data = re.search(r"write:\s+ops/s\s+kB/s\s+kB/op\s+retrans\s+avg RTT \(ms\)\s+avg exe \(ms\)\s+avg queue \(ms\)\s+errors\n\s+([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9]+)\s+\([0-9.]+\%\)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9]+)", data)
-    write_ops_per_sec, write_kb_per_sec, write_kb_per_op, write_retrans, write_avg_rtt, write_avg_exe, write_avg_queue, write_errors = write_data.groups() if write_data else (None, None, None, None, None, None, None, None)
-
-    # Construct the dictionary with parsed data
-    nfsiostat_json = {
-        "server_address": server_address,
-        "nfs_mount": nfs_mount,
-        "mount_point": mount_point,
-        "ops_per_sec": ops_per_sec,
-        "rpc_bklog": rpc_bklog,
-        "read": {
-            "ops_per_sec": read_ops_per_sec,
-            "kb_per_sec": read_kb_per_sec,
-            "kb_per_op": read_kb_per_op,
-            "retrans": read_retrans,
-            "avg_rtt": read_avg_rtt,
-            "avg_exe": read_avg_exe,
-            "avg_queue": read_avg_queue,
-            "errors": read_errors
-        },
-        "write": {
-            "ops_per_sec": write_ops_per_sec,
-            "kb_per_sec": write_kb_per_sec,
-            "kb_per_op": write_kb_per_op,
-            "retrans": write_retrans,
-            "avg_rtt": write_avg_rtt,
-            "avg_exe": write_avg_exe,
-            "avg_queue": write_avg_queue,
-            "errors": write_errors
-        }
-    }
+MOUNTSTATS_PATH = '/proc/self/mountstats'
+
+REQUIREMENTS = {"paths": ("/proc/self/mountstats",)}
+
+# one record per mount
+register_measurement('nfsstats', ("host", "server", "export", "mount_point"))
+
+# per-op counters: ops, transmissions, major timeouts, bytes sent, bytes received,
+# cumulative queue, rtt and execute time in ms, errors (kernel >= 5.3)
+PER_OP_FIELDS = ("ops", "trans", "timeouts", "bytes_sent", "bytes_recv", "queue_ms", "rtt_ms", "execute_ms", "errors")
+
+# position of the 'sends' and 'bklog_u' counters on the xprt line, per transport
+XPRT_COUNTERS = {"tcp": (6, 10), "rdma": (6, 10), "udp": (3, 7)}
+
+_OCTAL_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+_previous = {}
+_previous_lock = threading.Lock()
+
 
-    return nfsiostat_json
+def _unescape(path):
+    # mountstats escapes spaces and friends as \040
+    return _OCTAL_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), path)
 
 
+def parse_mountstats(data):
+    """Return {mount_point: {...counters}} for every NFS mount in /proc/self/mountstats."""
+    mounts = {}
+    mount = None
+    in_per_op = False
+    for line in data.splitlines():
+        if line.startswith('device '):
+            parts = line.split()
+            # device <server:/export> mounted on <mount point> with fstype <type> ...
+            mount = None
+            in_per_op = False
+            if len(parts) >= 8 and parts[7].startswith('nfs'):
+                server, _, export = _unescape(parts[1]).partition(':')
+                mount = {"server": server, "export": export, "age": 0, "sends": 0, "backlog": 0, "ops": {}}
+                mounts[_unescape(parts[4])] = mount
+            continue
+        if mount is None:
+            continue
+
+        line = line.strip()
+        if line.startswith('age:'):
+            mount["age"] = int(line.split()[1])
+        elif line.startswith('xprt:'):
+            parts = line.split()[1:]
+            positions = XPRT_COUNTERS.get(parts[0])
+            if positions and len(parts) > positions[1]:
+                mount["sends"] = int(parts[positions[0]])
+                mount["backlog"] = int(parts[positions[1]])
+        elif line.startswith('per-op statistics'):
+            in_per_op = True
+        elif in_per_op and ':' in line:
+            op, _, counters = line.partition(':')
+            mount["ops"][op] = dict(zip(PER_OP_FIELDS, map(int, counters.split())))
+    return mounts
+
+
+def _op_stats(prefix, current, previous, elapsed):
+    last = previous or {}
+    delta = {key: current.get(key, 0) - last.get(key, 0) for key in PER_OP_FIELDS}
+    ops = delta["ops"]
+    kilobytes = (delta["bytes_sent"] + delta["bytes_recv"]) / 1024
+    return {
+        f"{prefix}_ops_per_sec": round(ops / elapsed, 3),
+        f"{prefix}_kb_per_sec": round(kilobytes / elapsed, 3),
+        f"{prefix}_kb_per_op": round(kilobytes / ops, 3) if ops else 0.0,
+        f"{prefix}_retrans": delta["trans"] - ops,
+        f"{prefix}_avg_rtt": round(delta["rtt_ms"] / ops, 3) if ops else 0.0,
+        f"{prefix}_avg_exe": round(delta["execute_ms"] / ops, 3) if ops else 0.0,
+        f"{prefix}_avg_queue": round(delta["queue_ms"] / ops, 3) if ops else 0.0,
+        f"{prefix}_errors": delta["errors"],
+    }
+
 
 def get_nfs_io_stats():
-    # Get NFS IO Stats
-    output = subprocess.check_output(["nfsiostat"], shell=True).decode('utf-8')
-    return json.dumps(parse_nfsiostat(output))
- 
+    with open(MOUNTSTATS_PATH, 'r') as f:
+        mounts = parse_mountstats(f.read())
+    now = time.monotonic()
+    hostname = socket.gethostname()
+
+    records = []
+    with _previous_lock:
+        for mount_point, mount in mounts.items():
+            previous = _previous.get(mount_point)
+            _previous[mount_point] = (now, mount)
+            if previous is not None and previous[1]["sends"] <= mount["sends"]:
+                elapsed = now - previous[0]
+                last = previous[1]
+            else:
+                # first sample or remounted, report the averages since mount like nfsiostat does
+                elapsed = mount["age"]
+                last = {"sends": 0, "backlog": 0, "ops": {}}
+            if elapsed <= 0:
+                continue
+
+            sends = mount["sends"] - last["sends"]
+            record = {
+                "host": hostname,
+                "server": mount["server"],
+                "export": mount["export"],
+                "mount_point": mount_point,
+                "ops_per_sec": round(sends / elapsed, 3),
+                "rpc_bklog": round((mount["backlog"] - last["backlog"]) / sends, 3) if sends else 0.0,
+            }
+            for op, prefix in (("READ", "read"), ("WRITE", "write")):
+                record.update(_op_stats(prefix, mount["ops"].get(op, {}), last["ops"].get(op), elapsed))
+            records.append(record)
+
+        for mount_point in set(_previous) - set(mounts):
+            del _previous[mount_point]
+    return records
+
 
 def collect_data():
     try:
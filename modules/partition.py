@@ -1,21 +1,151 @@
-import socket
 import os
-import psutil
+import queue
+import select
+import socket
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
 from modules import logger
 
-def get_disk_space_usage(device):
+REQUIREMENTS = {"paths": ("/proc/self/mountinfo",)}
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+STATVFS_TIMEOUT = float(os.getenv("STATVFS_TIMEOUT", 5))
+QUARANTINE_SECONDS = float(os.getenv("MOUNT_QUARANTINE_SECONDS", 300))
+
+
+def _unescape(path):
+    # mountinfo escapes space, tab, newline and backslash as \ooo
+    parts = path.split('\\')
+    return parts[0] + ''.join(chr(int(part[:3], 8)) + part[3:] for part in parts[1:])
+
+
+class MountTable:
+    """
+    Mount points from /proc/self/mountinfo, re-read only when the kernel signals
+    a change of the mount table (POLLPRI on the open mountinfo file).
+    """
+
+    def __init__(self, path=MOUNTINFO_PATH):
+        self.path = path
+        self.mounts = {}
+        self._file = open(path, 'r')
+        self._poll = select.poll()
+        self._poll.register(self._file, select.POLLPRI | select.POLLERR)
+        self._read()
+
+    def _read(self):
+        self._file.seek(0)
+        mounts = {}
+        for line in self._file.read().splitlines():
+            # id parent major:minor root mount_point options [optional...] - fstype source super_options
+            fields, _, tail = line.partition(' - ')
+            fields, tail = fields.split(), tail.split()
+            if len(fields) < 5 or not tail:
+                continue
+            mounts[_unescape(fields[4])] = tail[0]
+        self.mounts = mounts
+
+    def get(self):
+        if self._poll.poll(0):
+            logger.debug("Mount table changed, re-reading mountinfo")
+            self._read()
+        return self.mounts
+
+
+class StatvfsWorker:
+    """A daemon thread running the statvfs calls it is handed one after the other."""
+
+    def __init__(self):
+        self._requests = queue.SimpleQueue()
+        threading.Thread(target=self._run, name="statvfs", daemon=True).start()
+
+    def submit(self, path):
+        future = Future()
+        self._requests.put((path, future))
+        return future
+
+    def stop(self):
+        # the thread exits once its current call returned
+        self._requests.put(None)
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            path, future = request
+            try:
+                future.set_result(os.statvfs(path))
+            except Exception as e:
+                future.set_exception(e)
+
+
+class MountQuarantine:
+    """
+    Runs statvfs on a worker thread with a hard timeout.
+
+    A mount that times out (typically a hung NFS server) is skipped until its
+    stuck call returned and QUARANTINE_SECONDS passed, so it never stalls a
+    later cycle. The worker stuck in that call is retired and replaced, at most
+    one thread per hung mount is ever blocked.
+    """
+
+    def __init__(self, timeout=STATVFS_TIMEOUT, quarantine_seconds=QUARANTINE_SECONDS):
+        self.timeout = timeout
+        self.quarantine_seconds = quarantine_seconds
+        self._quarantined = {}
+        self._lock = threading.Lock()
+        self._worker = StatvfsWorker()
+
+    def statvfs(self, path):
+        with self._lock:
+            quarantined = self._quarantined.get(path)
+            if quarantined is not None:
+                pending, until = quarantined
+                if not pending.done() or time.monotonic() < until:
+                    return None
+                del self._quarantined[path]
+            worker = self._worker
+
+        future = worker.submit(path)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            logger.warning(f"statvfs on {path} timed out after {self.timeout}s, quarantining the mount")
+            with self._lock:
+                self._quarantined[path] = (future, time.monotonic() + self.quarantine_seconds)
+                if self._worker is worker:
+                    worker.stop()
+                    self._worker = StatvfsWorker()
+            return None
+
+
+mount_table = MountTable()
+mount_quarantine = MountQuarantine()
+
+
+def get_disk_space_usage(device, fstype=None):
     try:
-        # Get disk usage information using psutil
-        partition = psutil.disk_usage(device)
+        stat = mount_quarantine.statvfs(device)
+        if stat is None:
+            return None
+
+        # same arithmetic as psutil.disk_usage
+        total = stat.f_blocks * stat.f_frsize
+        free = stat.f_bavail * stat.f_frsize
+        used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+        total_user = used + free
 
         # Create a dictionary with relevant information
         disk_space_info = {
             'host': socket.gethostname(),
             'device': device,
-            'Total': partition.total,
-            'Used': partition.used,
-            'Free': partition.free,
-            'Percent': partition.percent
+            'fstype': fstype,
+            'Total': total,
+            'Used': used,
+            'Free': free,
+            'Percent': round(used / total_user * 100, 1) if total_user else 0.0
         }
 
         return disk_space_info
@@ -25,20 +155,20 @@ def get_disk_space_usage(device):
 
 def get_disk_usage_for_mount_points(mnt_directory='/mnt'):
     try:
-        # Get a list of items (mount points) inside the specified directory
-        mount_points = [item for item in os.listdir(mnt_directory) if os.path.ismount(os.path.join(mnt_directory, item))]
+        mounts = mount_table.get()
         data = []
-        data.append(get_disk_space_usage('/'))
+        data.append(get_disk_space_usage('/', mounts.get('/')))
 
         if not os.getenv("STORAGE_SERVER"):
-            return data
+            return [record for record in data if record]
 
-        # Get and print disk space usage for each mount point
-        for mount_point in mount_points:
-            full_path = os.path.join(mnt_directory, mount_point)
-            data.append(get_disk_space_usage(full_path))
+        # Get disk space usage for each mount point directly below the specified directory
+        prefix = mnt_directory.rstrip('/') + '/'
+        for mount_point in sorted(mounts):
+            if mount_point.startswith(prefix) and '/' not in mount_point[len(prefix):]:
+                data.append(get_disk_space_usage(mount_point, mounts[mount_point]))
 
-        return data
+        return [record for record in data if record]
 
     except Exception as e:
         logger.debug(f"Error: {e}")
@@ -55,4 +185,3 @@ def collect_data():
 
 if __name__ == "__main__":
     print(collect_data())
-
@@ -0,0 +1,81 @@
+"""Small /proc readers shared by the collectors, no subprocesses involved."""
+
+import threading
+import time
+
+PROC_STAT_FIELDS = ("user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal", "guest", "guest_nice")
+
+DISKSTATS_FIELDS = ("reads", "reads_merged", "sectors_read", "read_ms", "writes", "writes_merged",
+                    "sectors_written", "write_ms", "in_flight", "io_ms", "weighted_io_ms")
+
+NET_DEV_FIELDS = ("rx_bytes", "rx_packets", "rx_errs", "rx_drop", "rx_fifo", "rx_frame", "rx_compressed",
+                  "rx_multicast", "tx_bytes", "tx_packets", "tx_errs", "tx_drop", "tx_fifo", "tx_colls",
+                  "tx_carrier", "tx_compressed")
+
+
+def read_proc_stat(path='/proc/stat'):
+    """Return {'cpu': {...}, 'cpu0': {...}, ...} with the jiffies counters of every cpu line."""
+    cpus = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.startswith('cpu'):
+                break
+            parts = line.split()
+            cpus[parts[0]] = dict(zip(PROC_STAT_FIELDS, map(int, parts[1:])))
+    return cpus
+
+
+def read_meminfo(path='/proc/meminfo'):
+    """Return {'MemTotal': 16316412, ...}, values in kB."""
+    meminfo = {}
+    with open(path, 'r') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            meminfo[key] = int(value.split()[0])
+    return meminfo
+
+
+def read_pressure(resource, path='/proc/pressure'):
+    """Return {'some': {'avg10': 0.1, ..., 'total': 123}, 'full': {...}} for cpu, memory or io."""
+    pressure = {}
+    with open(f'{path}/{resource}', 'r') as f:
+        for line in f:
+            kind, *values = line.split()
+            pressure[kind] = {key: float(value) for key, value in (item.split('=') for item in values)}
+    return pressure
+
+
+def read_diskstats(path='/proc/diskstats'):
+    """Return {'sda': {'reads': ..., 'sectors_read': ..., 'io_ms': ...}, ...} for every block device."""
+    disks = {}
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            disks[parts[2]] = dict(zip(DISKSTATS_FIELDS, map(int, parts[3:14])))
+    return disks
+
+
+def read_net_dev(path='/proc/net/dev'):
+    """Return {'eth0': {'rx_bytes': ..., 'tx_bytes': ...}, ...} for every interface."""
+    interfaces = {}
+    with open(path, 'r') as f:
+        # skip the two header lines
+        for line in f.readlines()[2:]:
+            iface, counters = line.split(':', 1)
+            interfaces[iface.strip()] = dict(zip(NET_DEV_FIELDS, map(int, counters.split())))
+    return interfaces
+
+
+_net_dev_cache = (0.0, None)
+_net_dev_lock = threading.Lock()
+
+
+def read_net_dev_cached(max_age=1.0):
+    """Return (timestamp, read_net_dev()), reusing a parse that is at most `max_age` seconds old."""
+    global _net_dev_cache
+    with _net_dev_lock:
+        timestamp, interfaces = _net_dev_cache
+        if interfaces is None or time.monotonic() - timestamp > max_age:
+            timestamp, interfaces = time.monotonic(), read_net_dev()
+            _net_dev_cache = (timestamp, interfaces)
+        return timestamp, interfaces
@@ -1,21 +1,136 @@
+import os
+import re
 import socket
-import json
-import subprocess
+import threading
 
 from modules import logger
 
+HWMON_PATH = '/sys/class/hwmon'
 
-def get_sensor_data():
-    # Run the 'sensors -j' command
-    sensors_command = 'sensors -j'
-    output_bytes = subprocess.check_output(sensors_command, shell=True)
+REQUIREMENTS = {"paths": ("/sys/class/hwmon",)}
+
+# sysfs input kind -> divisor to get °C / W / RPM
+HWMON_DIVISORS = {
+    "temp": 1000,
+    "power": 1000000,
+    "fan": 1,
+}
+HWMON_INPUT_FILE = re.compile(r'^(temp|power|fan)(\d+)_(input|average)$')
+
+# legacy field -> (chip name, input kind, sensor label or None for any), first match wins
+COMPATIBILITY_FIELDS = {
+    "power_usage_watts": [("power_meter", "power", None)],
+    "disk temp": [("nvme", "temp", "Composite")],
+    "cpu tctl": [("k10temp", "temp", "Tctl"), ("coretemp", "temp", "Package id 0")],
+    "cpu tccd1": [("k10temp", "temp", "Tccd1")],
+    "cpu tccd2": [("k10temp", "temp", "Tccd2")],
+}
+
+
+class HwmonSensor:
+    __slots__ = ("chip", "kind", "label", "field", "path", "divisor")
+
+    def __init__(self, chip, kind, label, field, path, divisor):
+        self.chip = chip
+        self.kind = kind
+        self.label = label
+        self.field = field
+        self.path = path
+        self.divisor = divisor
+
+
+def _read_text(path):
+    with open(path, 'r') as f:
+        return f.read().strip()
+
+
+def _field_name(*parts):
+    return re.sub(r'[^a-z0-9]+', '_', '_'.join(parts).lower()).strip('_')
+
+
+class HwmonIndex:
+    """
+    Index of every temperature, power and fan input under /sys/class/hwmon.
 
-    # Decode the output from bytes to a string
-    sensors_output = output_bytes.decode('utf-8')
+    The directory is scanned once, reads afterwards only open the input files
+    of the index. The index is rebuilt when the set of hwmon devices changes
+    (hotplug) or an indexed input disappears.
+    """
 
-    # Parse the JSON output
-    sensor_data = json.loads(sensors_output)
+    def __init__(self, path=HWMON_PATH):
+        self.path = path
+        self.devices = None
+        self.sensors = []
+        self._lock = threading.Lock()
 
+    def _list_devices(self):
+        try:
+            return sorted(os.listdir(self.path))
+        except FileNotFoundError:
+            return []
+
+    def build(self):
+        devices = self._list_devices()
+        chips = []
+        for device in devices:
+            device_path = os.path.join(self.path, device)
+            try:
+                chip = _read_text(os.path.join(device_path, 'name'))
+            except OSError:
+                continue
+            # sort by the underlying device so the numbering doesn't depend on probe order
+            chips.append((os.path.realpath(os.path.join(device_path, 'device')), chip, device_path))
+        chips.sort()
+
+        sensors = []
+        seen = {}
+        for _, chip, device_path in chips:
+            seen[chip] = seen.get(chip, 0) + 1
+            chip_id = chip if seen[chip] == 1 else f"{chip}{seen[chip] - 1}"
+            inputs = {}
+            for filename in sorted(os.listdir(device_path)):
+                match = HWMON_INPUT_FILE.match(filename)
+                if match is None:
+                    continue
+                kind, number, reading = match.groups()
+                # prefer the averaged power reading like the power_meter driver reports it
+                if (kind, number) in inputs and reading != 'average':
+                    continue
+                inputs[(kind, number)] = filename
+
+            for (kind, number), filename in inputs.items():
+                try:
+                    label = _read_text(os.path.join(device_path, f"{kind}{number}_label"))
+                except OSError:
+                    label = f"{kind}{number}"
+                sensors.append(HwmonSensor(chip, kind, label, _field_name(chip_id, label, kind),
+                                           os.path.join(device_path, filename), HWMON_DIVISORS[kind]))
+
+        with self._lock:
+            self.devices = devices
+            self.sensors = sensors
+        logger.debug(f"Indexed {len(sensors)} hwmon sensors")
+
+    def read(self):
+        if self.devices is None or self._list_devices() != self.devices:
+            self.build()
+
+        values = []
+        for sensor in self.sensors:
+            try:
+                values.append((sensor, int(_read_text(sensor.path)) / sensor.divisor))
+            except OSError:
+                # the device went away, pick up the new layout next time
+                self.devices = []
+            except ValueError:
+                continue
+        return values
+
+
+hwmon_index = HwmonIndex()
+
+
+def get_sensor_data():
     response =  {
         "host": socket.gethostname(),
         "power_usage_watts": 0,
@@ -25,28 +140,17 @@ def get_sensor_data():
         "cpu tccd2": 0,
     }
 
-    for k in sensor_data.keys():
-
-        # parse power if any
-        if k.startswith("power_meter"):
-            if sensor_data[k].get("power0", None) is not None:
-                response["power_usage_watts"] = sensor_data[k].get("power0", {}).get("power0_average", 0)
-            else:
-                response["power_usage_watts"] = sensor_data[k].get("power1", {}).get("power1_average", 0)
-        
-        # parse nvme if any
-        elif k.startswith("nvme-pci"):
-            response["disk temp"] = sensor_data[k].get("Composite", {}).get("temp1_input", 0)
-        
-        # parse amd cpu power from cpu 0
-        elif k.startswith("k10temp-pci-00"):
-            response["cpu tctl"] = sensor_data[k].get("Tctl", {}).get("temp1_input", 0)
-            response["cpu tccd1"] = sensor_data[k].get("Tccd1", {}).get("temp3_input", 0)
-            response["cpu tccd2"] = sensor_data[k].get("Tccd2", {}).get("temp4_input", 0)
-
-        # parse cpu power of intel cpu from cpu 0
-        elif k == "coretemp-isa-0000":
-            response["cpu tctl"] = sensor_data[k].get("Package id 0", {}).get("temp1_input", 0)
+    readings = hwmon_index.read()
+    for sensor, value in readings:
+        response[sensor.field] = value
+
+    for field, candidates in COMPATIBILITY_FIELDS.items():
+        for chip, kind, label in candidates:
+            value = next((value for sensor, value in readings
+                          if sensor.chip == chip and sensor.kind == kind and label in (None, sensor.label)), None)
+            if value is not None:
+                response[field] = value
+                break
 
     return response
 
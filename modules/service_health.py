@@ -2,6 +2,8 @@ import os
 import time
 from modules import logger
 
+REQUIREMENTS = {"python_modules": ("psutil",)}
+
 def collect_data():
     """Collect service health metrics"""
     try:
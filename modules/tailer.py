@@ -0,0 +1,103 @@
+import os
+import traceback
+
+import inotify.adapters
+
+from modules import logger
+
+TAIL_BATCH_SIZE = 500
+
+
+class LogTailer:
+    """
+    Follows an append-only log file and hands new lines to `on_lines` in batches.
+
+    Only the bytes appended since the last read are read. The directory is
+    watched rather than the file, so a rotated (new inode) or truncated file is
+    picked up from its start, and a partial last line is held back until its
+    newline arrives. Every line appended in one burst ends up in the same
+    batch of at most `batch_size` lines.
+    """
+
+    def __init__(self, path, on_lines, batch_size=TAIL_BATCH_SIZE, from_start=False):
+        self.path = path
+        self.on_lines = on_lines
+        self.batch_size = batch_size
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        self._partial = b''
+        self._open(seek_end=not from_start)
+
+    def _open(self, seek_end=False):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            self._inode = None
+            return
+        stat = os.fstat(self._file.fileno())
+        self._inode = stat.st_ino
+        self._offset = stat.st_size if seek_end else 0
+        self._partial = b''
+
+    def read_new_lines(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if self._file is None or stat.st_ino != self._inode:
+            leftover = b''
+            if self._file is not None:
+                # finish what was written to the old file before it was rotated
+                self._file.seek(self._offset)
+                leftover = self._partial + self._file.read()
+                if leftover and not leftover.endswith(b'\n'):
+                    leftover += b'\n'
+                logger.debug(f"{self.path} was rotated, reading the new file from the start")
+            self._open()
+            self._partial = leftover
+        elif stat.st_size < self._offset:
+            logger.debug(f"{self.path} was truncated, reading from the start")
+            self._offset = 0
+            self._partial = b''
+        if self._file is None:
+            return []
+
+        self._file.seek(self._offset)
+        data = self._file.read()
+        self._offset += len(data)
+        if not data:
+            return []
+
+        data = self._partial + data
+        complete, _, self._partial = data.rpartition(b'\n')
+        if not complete:
+            return []
+        return [line for line in complete.decode('utf-8', errors='replace').split('\n') if line.strip()]
+
+    def dispatch(self):
+        lines = self.read_new_lines()
+        for start in range(0, len(lines), self.batch_size):
+            try:
+                self.on_lines(lines[start:start + self.batch_size])
+            except Exception:
+                logger.debug(traceback.format_exc())
+
+    def run(self):
+        directory, filename = os.path.split(os.path.abspath(self.path))
+        i = inotify.adapters.Inotify()
+        i.add_watch(directory)
+        try:
+            for event in i.event_gen(yield_nones=False):
+                (_, type_names, path, event_filename) = event
+                if event_filename != filename:
+                    continue
+                if {"IN_MODIFY", "IN_CREATE", "IN_MOVED_TO"} & set(type_names):
+                    self.dispatch()
+        finally:
+            i.remove_watch(directory)
+            if self._file is not None:
+                self._file.close()
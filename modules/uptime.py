@@ -1,6 +1,8 @@
 import socket
 from modules import logger
 
+REQUIREMENTS = {"paths": ("/proc/uptime",)}
+
 
 def get_system_uptime_seconds():
     try:
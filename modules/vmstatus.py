@@ -1,13 +1,16 @@
 import socket
 import traceback
-from threading import Thread
-import inotify.adapters
+
+from connection import write_pipeline
 from modules import logger
+from modules.tailer import LogTailer
+
+REQUIREMENTS = {"python_modules": ("inotify",), "paths": ("/var/log/pve/tasks",)}
 
 def parse_data(log):
 	log_parts = log.split(':')
 
-	if log_parts[5] != 'qmstart' and log_parts[5] != 'qmstop':
+	if len(log_parts) < 9 or (log_parts[5] != 'qmstart' and log_parts[5] != 'qmstop'):
 		return
 
 	log_data = {
@@ -16,27 +19,21 @@ def parse_data(log):
 		'vmid': log_parts[6],
 		'details': log_parts[8].strip()
 	}
+	return log_data
+
+def send_lines(lines):
+	for line in lines:
+		log_data = parse_data(line.strip())
+		if log_data:
+			write_pipeline.write_record('vmstatus', log_data)
 
 def collect_data_continuously():
 	log_file="/var/log/pve/tasks/index"
-	i = inotify.adapters.Inotify()
-	i.add_watch(log_file)
 
 	try:
-		for event in i.event_gen(yield_nones=False):
-			(_, type_names, path, filename) = event
-
-			if "IN_MODIFY" in type_names:
-				with open(log_file, 'r') as file:
-					lines = file.readlines()
-					last_line = lines[-1].strip()
-					t1 = Thread(target=parse_data, args=(last_line,))
-					t1.run()
+		LogTailer(log_file, send_lines).run()
 	except Exception:
 		logger.debug(f"Failed to capture vm_status {traceback.format_exc()}")
 
-	finally:
-		i.remove_watch(log_file)
-
 # if __name__=="__main__":
 # 	collect_data()
@@ -0,0 +1,101 @@
+import os
+import ast
+import shutil
+import importlib
+import importlib.util
+import traceback
+
+from modules import get_module_settings, logger
+
+# smartctl and friends usually live in sbin, which isn't on the PATH of an unprivileged user
+BINARY_SEARCH_PATH = os.pathsep.join([os.getenv("PATH", os.defpath), "/usr/local/sbin", "/usr/sbin", "/sbin"])
+
+
+class Collector:
+    __slots__ = ("name", "binaries", "python_modules", "paths")
+
+    def __init__(self, name, binaries=(), python_modules=(), paths=()):
+        self.name = name
+        self.binaries = tuple(binaries)
+        self.python_modules = tuple(python_modules)
+        self.paths = tuple(paths)
+
+    def missing(self):
+        """Return a description of every requirement this host doesn't meet."""
+        missing = [f"binary {binary}" for binary in self.binaries
+                   if shutil.which(binary, path=BINARY_SEARCH_PATH) is None]
+        # find_spec locates the package without importing it
+        missing += [f"python module {module}" for module in self.python_modules
+                    if importlib.util.find_spec(module) is None]
+        missing += [f"path {path}" for path in self.paths if not os.path.exists(path)]
+        return missing
+
+
+def read_requirements(spec):
+    """
+    Return the REQUIREMENTS dict a collector module declares, {} if it has none.
+
+    A collector module may declare REQUIREMENTS = {"binaries": (...),
+    "python_modules": (...), "paths": (...)} as a literal. It is read from the
+    source rather than by importing the module, and the module is only
+    imported once every requirement is met, so it can import the declared
+    packages at its top. An optional probe() then runs the checks that need
+    code, returning None when usable or the reason it isn't.
+    """
+    with open(spec.origin, 'r') as f:
+        tree = ast.parse(f.read(), spec.origin)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "REQUIREMENTS"
+                                                for target in node.targets):
+            return ast.literal_eval(node.value)
+    return {}
+
+
+def get_collector(name, spec):
+    """Return the module's declared requirements, extended by a "requires" block in its settings."""
+    requirements = read_requirements(spec)
+    requires = get_module_settings(name).get("requires") or {}
+    return Collector(
+        name,
+        binaries=tuple(requirements.get("binaries", ())) + tuple(requires.get("binaries", ())),
+        python_modules=tuple(requirements.get("python_modules", ())) + tuple(requires.get("python_modules", ())),
+        paths=tuple(requirements.get("paths", ())) + tuple(requires.get("paths", ())),
+    )
+
+
+def check_collector(name):
+    """Return why `name` can't run on this host, or None when it can."""
+    spec = importlib.util.find_spec(f"modules.{name}")
+    if spec is None:
+        return "no such module"
+    missing = get_collector(name, spec).missing()
+    if missing:
+        return f"missing {', '.join(missing)}"
+
+    module = importlib.import_module(f"modules.{name}")
+    if not any(callable(getattr(module, entry, None)) for entry in ("collect_data", "collect_data_continuously")):
+        return "neither collect_data() nor collect_data_continuously()"
+    probe = getattr(module, "probe", None)
+    if probe is not None:
+        try:
+            return probe()
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            return f"probe failed: {e}"
+    return None
+
+
+def probe_collectors(module_names):
+    """Return the modules whose requirements are met, logging once for every disabled one."""
+    available = []
+    for name in module_names:
+        try:
+            reason = check_collector(name)
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            reason = f"failed to load: {e}"
+        if reason:
+            logger.warning(f"Disabling {name}: {reason}")
+            continue
+        available.append(name)
+    return available
@@ -0,0 +1,148 @@
+import os
+import time
+import threading
+import traceback
+from itertools import islice
+
+from modules import logger
+
+INFLUX_SPOOL_DIR = os.getenv("INFLUX_SPOOL_DIR", "/var/lib/kvm-monitor/spool")
+INFLUX_SPOOL_MAX_BYTES = int(os.getenv("INFLUX_SPOOL_MAX_BYTES", 512 * 1024 * 1024))
+INFLUX_SPOOL_SEGMENT_BYTES = int(os.getenv("INFLUX_SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+INFLUX_SPOOL_SEGMENT_AGE = float(os.getenv("INFLUX_SPOOL_SEGMENT_AGE", 300))
+INFLUX_SPOOL_REPLAY_BATCH = int(os.getenv("INFLUX_SPOOL_REPLAY_BATCH", 20000))
+
+
+class DiskSpool:
+    """
+    Bounded, append-only spool of line-protocol records for when influx is slow or down.
+
+    Records are appended to segment files that are rotated by size and age.
+    Once the spool holds more than `max_bytes`, the oldest segments are deleted.
+    `replay()` streams the segments back oldest first, `batch_size` lines at a
+    time, so replaying never loads a whole segment into memory. A segment that
+    fails halfway is resumed from the same offset on the next replay.
+    """
+
+    SUFFIX = '.lp'
+
+    def __init__(self, directory=INFLUX_SPOOL_DIR, max_bytes=INFLUX_SPOOL_MAX_BYTES,
+                 segment_bytes=INFLUX_SPOOL_SEGMENT_BYTES, segment_age=INFLUX_SPOOL_SEGMENT_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._current = None
+        self._current_path = None
+        self._current_opened = 0.0
+        self._replay_offsets = {}
+
+        os.makedirs(directory, exist_ok=True)
+        # segment path -> size in bytes, survives restarts
+        self._sizes = {path: os.path.getsize(path) for path in self._segment_paths()}
+        if self._sizes:
+            logger.info(f"Found {self.size()} bytes of spooled points in {directory}")
+
+    def _segment_paths(self):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(self.SUFFIX))
+
+    def size(self):
+        return sum(self._sizes.values())
+
+    def has_data(self):
+        return bool(self._sizes)
+
+    def _close_current(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+            if not self._sizes.get(self._current_path):
+                self._remove(self._current_path)
+            self._current_path = None
+
+    def _open_current(self):
+        self._current_path = os.path.join(self.directory, f"{time.time_ns():020d}{self.SUFFIX}")
+        self._current = open(self._current_path, 'ab')
+        self._current_opened = time.monotonic()
+        self._sizes[self._current_path] = 0
+
+    def _remove(self, path):
+        self._sizes.pop(path, None)
+        self._replay_offsets.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def append(self, lines):
+        data = b'\n'.join(lines) + b'\n'
+        with self._lock:
+            # make room by dropping the oldest closed segments
+            while self.size() + len(data) > self.max_bytes:
+                oldest = next((path for path in sorted(self._sizes) if path != self._current_path), None)
+                if oldest is None:
+                    break
+                logger.warning(f"Spool over {self.max_bytes} bytes, dropping {oldest}")
+                self._remove(oldest)
+            if self.size() + len(data) > self.max_bytes:
+                self.dropped += len(lines)
+                return False
+
+            try:
+                if self._current is not None and (
+                        self._sizes[self._current_path] + len(data) > self.segment_bytes or
+                        time.monotonic() - self._current_opened > self.segment_age):
+                    self._close_current()
+                if self._current is None:
+                    self._open_current()
+                self._current.write(data)
+                self._current.flush()
+            except OSError:
+                logger.debug(traceback.format_exc())
+                self.dropped += len(lines)
+                return False
+            self._sizes[self._current_path] += len(data)
+            self.spooled += len(lines)
+            return True
+
+    def replay(self, write, batch_size=INFLUX_SPOOL_REPLAY_BATCH, max_batches=10):
+        """Hand up to `max_batches` batches to `write(bytes)`, stops at the first exception."""
+        with self._lock:
+            # the open segment becomes replayable, new points go to a fresh one
+            self._close_current()
+            paths = sorted(self._sizes)
+
+        batches = 0
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(self._replay_offsets.get(path, 0))
+                    while batches < max_batches:
+                        lines = list(islice(f, batch_size))
+                        if not lines:
+                            break
+                        write(b''.join(lines))
+                        batches += 1
+                        with self._lock:
+                            self._replay_offsets[path] = f.tell()
+                            self.replayed += len(lines)
+                    else:
+                        return
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._remove(path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "spooled": self.spooled,
+                "replayed": self.replayed,
+                "spool_dropped": self.dropped,
+                "spool_bytes": self.size(),
+            }
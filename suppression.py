@@ -0,0 +1,101 @@
+import threading
+import time
+
+from line_protocol import DEFAULT_TAGS, MEASUREMENT_TAGS
+from modules import get_module_settings
+
+DEFAULT_HEARTBEAT_SECONDS = 600
+
+
+class SeriesState:
+    __slots__ = ("values", "last_heartbeat", "last_seen")
+
+    def __init__(self, now):
+        self.values = {}
+        self.last_heartbeat = now
+        self.last_seen = now
+
+
+class ChangeSuppressor:
+    """
+    Drops fields whose value hasn't changed since it was last emitted.
+
+    Values are compared per series (measurement and tag values) and field.
+    Numeric fields listed in `deadband` are only emitted once they moved more
+    than the given absolute amount from the last emitted value, every other
+    field once it differs at all. A record without any remaining field is
+    dropped, and every `heartbeat_seconds` a series is emitted in full.
+    """
+
+    def __init__(self, deadband=None, heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS):
+        self.deadband = deadband or {}
+        self.heartbeat_seconds = heartbeat_seconds
+        self.suppressed = 0
+        self._series = {}
+        self._lock = threading.Lock()
+        self._last_expiry = time.monotonic()
+
+    def _changed(self, key, value, last):
+        if last is None:
+            return True
+        threshold = self.deadband.get(key)
+        if threshold is not None and isinstance(value, (int, float)) and isinstance(last, (int, float)):
+            return abs(value - last) > threshold
+        return value != last
+
+    def filter(self, measurement, record):
+        """Return the part of `record` that should be written, or None."""
+        tag_keys = MEASUREMENT_TAGS.get(measurement, DEFAULT_TAGS)
+        series_key = (measurement,) + tuple(record.get(key) for key in tag_keys)
+        now = time.monotonic()
+
+        with self._lock:
+            self._expire(now)
+            state = self._series.get(series_key)
+            if state is None:
+                state = self._series[series_key] = SeriesState(now)
+                heartbeat = True
+            else:
+                heartbeat = now - state.last_heartbeat >= self.heartbeat_seconds
+            if heartbeat:
+                state.last_heartbeat = now
+            state.last_seen = now
+
+            to_emit = {}
+            has_fields = False
+            for key, value in record.items():
+                if key in tag_keys:
+                    to_emit[key] = value
+                elif heartbeat or self._changed(key, value, state.values.get(key)):
+                    to_emit[key] = value
+                    state.values[key] = value
+                    has_fields = True
+                else:
+                    self.suppressed += 1
+
+        return to_emit if has_fields else None
+
+    def _expire(self, now):
+        # forget series that stopped reporting, at most once per heartbeat
+        if now - self._last_expiry < self.heartbeat_seconds:
+            return
+        self._last_expiry = now
+        for series_key in [key for key, state in self._series.items()
+                           if now - state.last_seen > 3 * self.heartbeat_seconds]:
+            del self._series[series_key]
+
+
+_suppressors = {}
+_suppressors_lock = threading.Lock()
+
+
+def get_suppressor(module_name):
+    """Return the ChangeSuppressor configured for `module_name`, or None when it has no "suppression" block."""
+    with _suppressors_lock:
+        if module_name not in _suppressors:
+            settings = get_module_settings(module_name).get("suppression")
+            _suppressors[module_name] = ChangeSuppressor(
+                deadband=settings.get("deadband"),
+                heartbeat_seconds=settings.get("heartbeat_seconds", DEFAULT_HEARTBEAT_SECONDS),
+            ) if settings else None
+        return _suppressors[module_name]
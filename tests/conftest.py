@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# read at import time by connection.py, spool.py and modules/kvm_monitor.py
+os.environ.setdefault("INFLUX_URL", "http://127.0.0.1:8086")
+os.environ["INFLUX_SPOOL_DIR"] = ""
+os.environ["CPU_SAMPLES_CHECKPOINT"] = os.path.join(tempfile.mkdtemp(prefix="kvm-monitor-tests-"), "cpu_samples.json")
@@ -0,0 +1,32 @@
+from aggregation import WindowAggregator
+
+
+def make_aggregator(**kwargs):
+    return WindowAggregator({"network": {"window_seconds": 30, "fields": ["speed"]}}, sample_interval=1, **kwargs)
+
+
+def feed(aggregator, measurement, seconds, **tags):
+    return [record for record in (aggregator.add(measurement, dict(tags, speed=float(t), t=t), now=float(t))
+                                  for t in range(seconds)) if record]
+
+
+def test_aggregated_measurement_ships_one_summary_per_window():
+    records = feed(make_aggregator(), "network", 61, host="h", iface="eth0")
+
+    assert [record["t"] for record in records] == [30, 60]
+    assert records[0]["speed_min"] == 0.0
+    assert records[0]["speed_max"] == 30.0
+
+
+def test_other_measurements_are_decimated_to_one_point_per_window():
+    records = feed(make_aggregator(), "cpustat", 91, host="h")
+
+    assert [record["t"] for record in records] == [0, 30, 60, 90]
+
+
+def test_decimation_is_per_series_and_configurable():
+    aggregator = make_aggregator(passthrough_seconds=10)
+    first = feed(aggregator, "cpustat", 21, host="a")
+    second = feed(aggregator, "cpustat", 21, host="b")
+
+    assert [record["t"] for record in first] == [record["t"] for record in second] == [0, 10, 20]
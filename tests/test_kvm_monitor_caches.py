@@ -0,0 +1,111 @@
+import pytest
+
+from modules.kvm_monitor import CpuSampleStore, DeviceCounterStore, DomainTopologyCache, get_disk_record
+
+HOST_A = "qemu+ssh://host-a/system"
+HOST_B = "qemu+ssh://host-b/system"
+UUID = "6f1c2a9e-0000-4000-8000-000000000001"
+OTHER_UUID = "6f1c2a9e-0000-4000-8000-000000000002"
+
+
+class FakeDomain:
+    def __init__(self, uuid, domain_id=1, disks=("vda",)):
+        self.uuid = uuid
+        self.domain_id = domain_id
+        self.disks = disks
+        self.xml_reads = 0
+
+    def UUIDString(self):
+        return self.uuid
+
+    def ID(self):
+        return self.domain_id
+
+    def XMLDesc(self, flags=0):
+        self.xml_reads += 1
+        disks = ''.join(f"<disk device='disk'><target dev='{disk}'/></disk>" for disk in self.disks)
+        return f"<domain><devices>{disks}<interface><target dev='vnet0'/></interface></devices></domain>"
+
+
+def test_cpu_samples_of_the_same_uuid_on_two_hypervisors_are_kept_apart():
+    store = CpuSampleStore(checkpoint_path=None)
+    store.update(HOST_A, UUID, 100.0, [100.0])
+    store.update(HOST_B, UUID, 5.0, [5.0])
+
+    # compared with host A's sample, host B's counter would look like a restarted domain
+    cpu_usage, vcpu_usage = store.update(HOST_B, UUID, 6.0, [6.0])
+    assert cpu_usage > 0 and vcpu_usage[0] > 0
+
+
+def test_cpu_sample_prune_only_touches_its_own_hypervisor():
+    store = CpuSampleStore(checkpoint_path=None)
+    store.update(HOST_A, UUID, 1.0, [1.0])
+    store.update(HOST_A, OTHER_UUID, 1.0, [1.0])
+    store.update(HOST_B, UUID, 1.0, [1.0])
+
+    store.prune([OTHER_UUID], HOST_A)
+
+    assert set(store._samples) == {(HOST_A, OTHER_UUID), (HOST_B, UUID)}
+
+
+def test_cpu_sample_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "state" / "cpu_samples.json")
+    store = CpuSampleStore(path)
+    store.update(HOST_A, UUID, 1.0, [0.5, 0.5])
+    store.update(HOST_B, UUID, 2.0, [1.0])
+    store.checkpoint()
+
+    loaded = CpuSampleStore(path)
+    loaded.load()
+
+    assert set(loaded._samples) == {(HOST_A, UUID), (HOST_B, UUID)}
+    assert loaded._samples[(HOST_B, UUID)].vcpu_times == [1.0]
+
+
+def test_topology_prune_and_invalidate_are_scoped():
+    cache = DomainTopologyCache()
+    domain_a, domain_b = FakeDomain(UUID), FakeDomain(UUID, disks=("sda", "sdb"))
+
+    assert cache.get(domain_a, HOST_A).disks == ["vda"]
+    assert cache.get(domain_b, HOST_B).disks == ["sda", "sdb"]
+
+    cache.prune([], HOST_A)
+    cache.invalidate(HOST_A, UUID)
+    assert cache.get(domain_b, HOST_B).disks == ["sda", "sdb"]
+    assert domain_b.xml_reads == 1
+
+    cache.get(domain_a, HOST_A)
+    assert domain_a.xml_reads == 2
+
+
+def test_device_counters_are_scoped_by_hypervisor():
+    store = DeviceCounterStore()
+    assert store.delta(HOST_A, UUID, ("disk", "vda"), {"rd.reqs": 100}, now=1.0) is None
+    assert store.delta(HOST_B, UUID, ("disk", "vda"), {"rd.reqs": 10}, now=1.0) is None
+
+    assert store.delta(HOST_A, UUID, ("disk", "vda"), {"rd.reqs": 150}, now=3.0) == (2.0, {"rd.reqs": 50})
+    assert store.delta(HOST_B, UUID, ("disk", "vda"), {"rd.reqs": 30}, now=3.0) == (2.0, {"rd.reqs": 20})
+
+
+def test_disk_latency_is_left_out_without_timing_counters():
+    # what the blockStats() fallback reports
+    counters = {"rd.reqs": 100, "rd.bytes": 4096, "wr.reqs": 10, "wr.bytes": 512, "errors": 0}
+    get_disk_record("latency-test", UUID, "vda", counters, now=1.0)
+    record = get_disk_record("latency-test", UUID, "vda", dict(counters, **{"rd.reqs": 200}), now=2.0)
+    assert record["rd_iops"] == 100.0
+    assert not any(key.endswith("_latency_ms") or key.endswith("_times") for key in record)
+    assert "fl_iops" not in record
+
+
+@pytest.mark.parametrize("store", [DeviceCounterStore(), DomainTopologyCache()], ids=["device_counters", "topology"])
+def test_prune_keeps_the_other_hypervisors_domains(store):
+    for scope in (HOST_A, HOST_B):
+        if isinstance(store, DomainTopologyCache):
+            store.get(FakeDomain(UUID), scope)
+        else:
+            store.delta(scope, UUID, ("interface", "vnet0"), {"rx.bytes": 1}, now=1.0)
+
+    store.prune([], HOST_B)
+
+    entries = store._samples if isinstance(store, DeviceCounterStore) else store._entries
+    assert set(entries) == {(HOST_A, UUID)}
@@ -0,0 +1,18 @@
+from modules.kvm_monitor import get_host_tag, parse_libvirt_uris
+
+
+def test_aliases_are_split_from_the_uris():
+    uris, aliases = parse_libvirt_uris("lab=test:///default, qemu+ssh://host-a/system,,")
+    assert uris == ["test:///default", "qemu+ssh://host-a/system"]
+    assert aliases == {"test:///default": "lab"}
+
+
+def test_equals_sign_in_a_query_parameter_is_not_an_alias():
+    uris, aliases = parse_libvirt_uris("qemu+ssh://host-a/system?keyfile=/root/.ssh/id")
+    assert uris == ["qemu+ssh://host-a/system?keyfile=/root/.ssh/id"]
+    assert aliases == {}
+
+
+def test_host_tags_of_hostless_uris_dont_collide():
+    assert get_host_tag("qemu+ssh://host-a/system") == "host-a"
+    assert get_host_tag("test:///default") != get_host_tag("test:///other")
@@ -0,0 +1,60 @@
+import math
+
+import pytest
+
+from line_protocol import LineProtocolEncoder, format_field_value, register_measurement
+
+register_measurement("test_escaping", ("host", "device", "mount point"))
+
+
+@pytest.fixture
+def encoder():
+    return LineProtocolEncoder()
+
+
+def test_tags_are_sorted_and_fields_follow(encoder):
+    line = encoder.encode("test_escaping", {"host": "node1", "device": "sda", "used": 5}, 123)
+    assert line == b"test_escaping,device=sda,host=node1 used=5i 123"
+
+
+def test_measurement_escaping(encoder):
+    line = encoder.encode("cpu load,x", {"host": "node1", "value": 1.5}, 1)
+    assert line == b"cpu\\ load\\,x,host=node1 value=1.5 1"
+
+
+def test_tag_key_and_value_escaping(encoder):
+    record = {"host": "node1", "device": "a,b=c d", "mount point": "/mnt/x y", "free": 1}
+    line = encoder.encode("test_escaping", record, 1)
+    assert line == b"test_escaping,device=a\\,b\\=c\\ d,host=node1,mount\\ point=/mnt/x\\ y free=1i 1"
+
+
+def test_field_key_and_string_value_escaping(encoder):
+    line = encoder.encode("test_escaping", {"host": "node1", "error text": 'say "hi" \\ bye'}, 1)
+    assert line == b'test_escaping,host=node1 error\\ text="say \\"hi\\" \\\\ bye" 1'
+
+
+def test_host_is_cut_at_the_first_dot(encoder):
+    line = encoder.encode("test_escaping", {"host": "node1.example.com", "value": 1}, 1)
+    assert line.startswith(b"test_escaping,host=node1 ")
+
+
+def test_missing_and_empty_tags_are_left_out(encoder):
+    line = encoder.encode("test_escaping", {"host": "node1", "device": "", "value": 1}, 1)
+    assert line == b"test_escaping,host=node1 value=1i 1"
+
+
+def test_record_without_fields_encodes_to_none(encoder):
+    assert encoder.encode("test_escaping", {"host": "node1", "value": None}, 1) is None
+    assert encoder.encode("test_escaping", {"host": "node1", "value": math.nan}, 1) is None
+
+
+@pytest.mark.parametrize("value, expected", [
+    (True, "true"),
+    (False, "false"),
+    (3, "3i"),
+    (0.25, "0.25"),
+    ("text", '"text"'),
+    (math.inf, None),
+])
+def test_format_field_value(value, expected):
+    assert format_field_value(value) == expected
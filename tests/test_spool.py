@@ -0,0 +1,104 @@
+import pytest
+
+from spool import DiskSpool
+
+
+def lines(start, count):
+    return [f"m,host=h value={i}i {i}".encode() for i in range(start, start + count)]
+
+
+class FailingWriter:
+    """Collects the written batches and raises on the `fail_at`th call."""
+
+    def __init__(self, fail_at=None):
+        self.batches = []
+        self.fail_at = fail_at
+
+    def __call__(self, data):
+        if self.fail_at is not None and len(self.batches) + 1 == self.fail_at:
+            self.fail_at = None
+            raise ConnectionError("influx unreachable")
+        self.batches.append(data)
+
+    def lines(self):
+        return [line for batch in self.batches for line in batch.splitlines()]
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return DiskSpool(str(tmp_path), max_bytes=1024 * 1024, segment_bytes=1024 * 1024, segment_age=300)
+
+
+def test_replay_returns_lines_in_order_and_empties_the_spool(spool):
+    spool.append(lines(0, 5))
+    spool.append(lines(5, 5))
+    writer = FailingWriter()
+
+    spool.replay(writer, batch_size=3)
+
+    assert writer.lines() == lines(0, 10)
+    assert not spool.has_data()
+    assert spool.stats()["replayed"] == 10
+
+
+def test_failed_replay_resumes_after_the_last_written_batch(spool):
+    spool.append(lines(0, 10))
+    writer = FailingWriter(fail_at=2)
+
+    with pytest.raises(ConnectionError):
+        spool.replay(writer, batch_size=4)
+    assert writer.lines() == lines(0, 4)
+    assert spool.has_data()
+
+    spool.replay(writer, batch_size=4)
+    assert writer.lines() == lines(0, 10)
+    assert not spool.has_data()
+
+
+def test_replay_stops_after_max_batches(spool):
+    spool.append(lines(0, 10))
+    writer = FailingWriter()
+
+    spool.replay(writer, batch_size=2, max_batches=2)
+    assert writer.lines() == lines(0, 4)
+
+    spool.replay(writer, batch_size=2, max_batches=10)
+    assert writer.lines() == lines(0, 10)
+
+
+def test_points_appended_during_replay_go_to_a_new_segment(spool):
+    spool.append(lines(0, 3))
+    writer = FailingWriter()
+
+    def write_and_append(data):
+        writer(data)
+        spool.append(lines(3, 2))
+
+    spool.replay(write_and_append, batch_size=10, max_batches=1)
+    spool.replay(writer, batch_size=10)
+    assert writer.lines() == lines(0, 5)
+
+
+def test_spool_drops_the_oldest_segments_beyond_max_bytes(tmp_path):
+    spool = DiskSpool(str(tmp_path), max_bytes=300, segment_bytes=100, segment_age=300)
+    for start in range(0, 40, 4):
+        spool.append(lines(start, 4))
+    writer = FailingWriter()
+
+    spool.replay(writer, batch_size=100)
+
+    assert spool.size() == 0
+    assert 0 < len(writer.lines()) < 40
+    # whatever survived is the newest data, still in order
+    assert writer.lines() == lines(40 - len(writer.lines()), len(writer.lines()))
+
+
+def test_spooled_segments_survive_a_restart(tmp_path):
+    DiskSpool(str(tmp_path)).append(lines(0, 3))
+
+    reopened = DiskSpool(str(tmp_path))
+    writer = FailingWriter()
+    assert reopened.has_data()
+
+    reopened.replay(writer)
+    assert writer.lines() == lines(0, 3)
@@ -0,0 +1,69 @@
+import pytest
+from influxdb_client.rest import ApiException
+
+from connection import WritePipeline
+from spool import DiskSpool
+
+
+def lines(count):
+    return [f"m,host=h value={i}i {i}".encode() for i in range(count)]
+
+
+class FakeInflux:
+    """Records the points it accepts, raises `error` for bodies of more than `max_points`."""
+
+    def __init__(self, error=None, max_points=None):
+        self.points = []
+        self.error = error
+        self.max_points = max_points
+
+    def __call__(self, body):
+        points = body.splitlines()
+        if self.error is not None and (self.max_points is None or len(points) > self.max_points):
+            raise self.error
+        self.points += points
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return DiskSpool(str(tmp_path), max_bytes=1024 * 1024, segment_bytes=1024 * 1024, segment_age=0)
+
+
+def pipeline_with(influx, spool=None):
+    pipeline = WritePipeline(spool=spool)
+    pipeline._send = influx
+    return pipeline
+
+
+@pytest.mark.parametrize("error", [ConnectionError("influx unreachable"), ApiException(status=503),
+                                   ApiException(status=429)])
+def test_retryable_errors_are_spooled(spool, error):
+    pipeline = pipeline_with(FakeInflux(error), spool)
+    assert not pipeline._write(lines(4))
+    assert pipeline.failed == 4 and pipeline.dropped == 0
+    assert spool.has_data()
+
+
+def test_rejected_batch_is_dropped_not_spooled(spool):
+    pipeline = pipeline_with(FakeInflux(ApiException(status=400, reason="Bad Request")), spool)
+    assert pipeline._write(lines(4))
+    assert pipeline.dropped == 4 and pipeline.written == 0 and pipeline.failed == 0
+    assert not spool.has_data()
+
+
+def test_too_large_batch_is_split():
+    influx = FakeInflux(ApiException(status=413), max_points=3)
+    pipeline = pipeline_with(influx)
+    assert pipeline._write(lines(10))
+    assert influx.points == lines(10)
+    assert pipeline.written == 10 and pipeline.dropped == 0
+
+
+def test_rejected_segment_does_not_block_replay(spool):
+    influx = FakeInflux(ConnectionError("influx unreachable"))
+    pipeline = pipeline_with(influx, spool)
+    pipeline._write(lines(4))
+    influx.error = ApiException(status=400)
+    pipeline._replay()
+    assert not spool.has_data()
+    assert pipeline.dropped == 4